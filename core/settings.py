@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'home.middleware.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,13 +65,24 @@ ROOT_URLCONF = 'core.urls'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'home.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
         ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'home.throttling.TokenBucketThrottle',
+    ],
+    # Anonymous clients are throttled by IP. X-Forwarded-For is only read
+    # when it comes from this many trusted proxies in front of the server;
+    # with none, any client could pick its own bucket.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
 }
 
+SIMPLE_JWT = {
+    'TOKEN_OBTAIN_SERIALIZER':
+        'home.serializers.ClaimsTokenObtainPairSerializer',
+}
 
 TEMPLATES = [
     {
@@ -119,6 +132,91 @@ DATABASES = {
         'PORT': '5432',
     }
 }
+# Cache
+# The catalogue cache shares the Redis instance used by Celery (on its own
+# database number); the test runner gets a local-memory stand-in.
+
+TESTING = 'test' in sys.argv
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_URL', 'redis://redis:6379/1'),
+    }
+}
+if TESTING:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+
+CATALOGUE_CACHE_TIMEOUT = 60 * 60
+# Cart summaries are keyed by Cart.updated_at; the timeout only bounds how
+# long an expired coupon keeps showing a discount.
+CART_SUMMARY_TIMEOUT = 5 * 60
+# Largest number of lines /api/cart/bulk/ accepts in one request.
+CART_BULK_MAX_ITEMS = 100
+# Seconds a cart line holds its stock after it was last changed, and the
+# number of expired lines home.tasks.release_expired_cart_holds releases
+# per transaction.
+CART_HOLD_TIMEOUT = 30 * 60
+CART_HOLD_SWEEP_BATCH = 5000
+# Rows fetched per server-side cursor round trip by streamed (NDJSON) lists.
+STREAM_CHUNK_SIZE = 2000
+# How long home.authentication keeps the user a JWT resolves to. Saving or
+# deleting the user drops the entry sooner.
+AUTH_USER_CACHE_TIMEOUT = 5 * 60
+
+# Token-bucket rate limits (home.throttling) by route name, for
+# authenticated users and for anonymous clients by IP: '<burst>/<period>'
+# refills the bucket at burst/period. 'default' covers unlisted routes.
+THROTTLE_RATES = {
+    'default': {'user': '600/min', 'anon': '120/min'},
+    'products-list': {'user': '120/min', 'anon': '60/min'},
+    # Every attempt costs a password hash.
+    'token_obtain_pair': {'user': '10/min', 'anon': '10/min'},
+    'user-register': {'anon': '10/hour'},
+}
+THROTTLE_REDIS_URL = os.getenv('THROTTLE_URL', 'redis://redis:6379/2')
+if os.getenv('THROTTLE_OFF') == '1':
+    # Servers under loadtest/serverbench: a few clients make all the
+    # requests, which the limits above would turn into 429s.
+    THROTTLE_RATES = {}
+if TESTING:
+    # In-process buckets, and no limits unless a test sets them.
+    THROTTLE_REDIS_URL = None
+    THROTTLE_RATES = {}
+
+# Maximum number of SQL queries per request, by route name, for the worst
+# case of the route (filtered lists, the first cart change creating the
+# cart). Enforced by home.tests.QueryBudgetTests and reported by
+# QueryCountMiddleware.
+QUERY_BUDGETS = {
+    'profile-list': 1,
+    'category-list': 1,
+    'products-list': 3,
+    'products-detail': 3,
+    'products-search': 2,
+    'products-list-reviews': 2,
+    'product-variants-list': 1,
+    'product-variants-detail': 1,
+    'async-products-list': 3,
+    'async-products-detail': 3,
+    'async-products-list-reviews': 2,
+    'async-category-list': 1,
+    'async-product-variants-list': 1,
+    'async-product-variants-detail': 1,
+    'cart-list': 1,
+    'cart-summary': 2,
+    'cart-add-item': 13,
+    'cart-bulk': 13,
+    'orders-list': 1,
+    'orders-list-order-items': 2,
+    'orders-create-order': 7,
+    'shipping-address-list': 1,
+    'wishlist-list': 1,
+    'coupons-list': 1,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -159,6 +257,12 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Order confirmations (home.tasks.send_order_confirmation).
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND',
+                          'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'orders@localhost')
+
 # CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
 # # Celery settings
 # CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
@@ -172,3 +276,25 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
+# Installed into the database scheduler when beat starts.
+CELERY_BEAT_SCHEDULE = {
+    'release-expired-cart-holds': {
+        'task': 'home.tasks.release_expired_cart_holds',
+        'schedule': 60.0,
+    },
+}
+if TESTING:
+    # Run tasks in-process, with in-memory broker and result backend.
+    CELERY_BROKER_URL = 'memory://'
+    CELERY_RESULT_BACKEND = 'cache+memory://'
+    CELERY_TASK_ALWAYS_EAGER = True
+
+# Ordered variants left with this many units or fewer are reported by the
+# order post-processing (home.tasks.check_order_stock), at most once per
+# LOW_STOCK_ALERT_INTERVAL seconds each.
+LOW_STOCK_THRESHOLD = 5
+LOW_STOCK_ALERT_INTERVAL = 60 * 60
+
+# Per-category overrides for the refill_stock task, keyed by category slug,
+# e.g. {'electronics': {'threshold': 5, 'refill_to': 50}}.
+STOCK_REFILL_POLICIES = {}
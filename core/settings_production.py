@@ -0,0 +1,45 @@
+"""
+Production serving profile, selected with
+``DJANGO_SETTINGS_MODULE=core.settings_production`` (the default under
+gunicorn, see gunicorn.conf.py).
+
+Database connections are kept open between requests and health-checked
+before reuse, or, with ``DB_POOL=1``, borrowed from a psycopg 3 connection
+pool. Use the pool under ASGI: persistent connections are per thread, and
+async requests do not run on a fixed one.
+"""
+import copy
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, SECRET_KEY
+
+DATABASES = copy.deepcopy(DATABASES)
+
+DEBUG = os.getenv('DJANGO_DEBUG') == '1'
+SECRET_KEY = os.getenv('DJANGO_SECRET_KEY', SECRET_KEY)
+ALLOWED_HOSTS = os.getenv(
+    'DJANGO_ALLOWED_HOSTS', 'localhost,127.0.0.1,web,web-asgi').split(',')
+
+DATABASES['default'].update({
+    'NAME': os.getenv('POSTGRES_DB', DATABASES['default']['NAME']),
+    'USER': os.getenv('POSTGRES_USER', DATABASES['default']['USER']),
+    'PASSWORD': os.getenv('POSTGRES_PASSWORD',
+                          DATABASES['default']['PASSWORD']),
+    'HOST': os.getenv('POSTGRES_HOST', DATABASES['default']['HOST']),
+    'PORT': os.getenv('POSTGRES_PORT', DATABASES['default']['PORT']),
+    'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 600)),
+    'CONN_HEALTH_CHECKS': True,
+})
+
+if os.getenv('DB_POOL') == '1':
+    # Pooled connections go back to the pool when a request finishes, so
+    # Django must not also keep them open.
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        },
+    }
@@ -0,0 +1,53 @@
+"""
+gunicorn settings, picked up from the working directory by
+``gunicorn core.wsgi:application`` (or ``core.asgi:application``).
+"""
+import multiprocessing
+import os
+
+# Serve with the production profile unless told otherwise.
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings_production')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Set GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker to serve
+# core.asgi. Event-loop workers default to one per CPU; threaded (gthread)
+# workers to CPU + 1, as their threads already overlap the time spent
+# waiting on the database; synchronous workers to the usual 2 x CPU + 1.
+# WEB_CONCURRENCY overrides any of them.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+cpus = multiprocessing.cpu_count()
+if 'uvicorn' in worker_class:
+    default_workers = cpus
+elif worker_class == 'gthread':
+    default_workers = cpus + 1
+else:
+    default_workers = cpus * 2 + 1
+workers = int(os.getenv('WEB_CONCURRENCY', default_workers))
+# More than one thread turns sync workers into gthread ones.
+threads = (int(os.getenv('GUNICORN_THREADS', 4))
+           if worker_class == 'gthread' else 1)
+
+# Database connections: with CONN_MAX_AGE every thread keeps its own, so one
+# server holds up to workers x threads of them (workers x DB_POOL_MAX_SIZE
+# with DB_POOL=1), and every web container adds as many again. Set
+# DB_MAX_CONNECTIONS to this server's share of Postgres's max_connections
+# to cap the workers accordingly.
+if os.getenv('DB_POOL') == '1':
+    connections_per_worker = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+else:
+    connections_per_worker = threads
+if os.getenv('DB_MAX_CONNECTIONS'):
+    workers = max(1, min(workers, int(os.getenv('DB_MAX_CONNECTIONS'))
+                         // connections_per_worker))
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth, staggered so they
+# do not all restart at once.
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
@@ -0,0 +1,150 @@
+"""
+Async-native catalogue reads for ASGI deployments, served under
+``/api/async/``.
+
+Each endpoint borrows the DRF viewset of the same read for its throttles,
+queryset, loading plan, filters, pagination and serializer, then fetches
+the rows with the async ORM. Serializers only see rows that were loaded or
+prefetched up front, or fetch their children with the async ORM
+(``ValuesSerializer``); a lazy query would raise
+``SynchronousOnlyOperation``.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+
+from . import cache
+from .loading import eager_load
+from .models import Product, Review
+from .rows import ValuesSerializer
+from .serializers import ReviewReadSerializer
+from .views import CategoryViewSet, ProductVarientViewSet, ProductViewSet
+
+
+def render(data, status=200, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status,
+                        headers=headers, content_type='application/json')
+
+
+def async_endpoint(handler):
+    """
+    ``GET``-only async view rendering ``APIException``s like DRF does.
+    """
+    @require_GET
+    @wraps(handler)
+    async def view(request, *args, **kwargs):
+        try:
+            return await handler(request, *args, **kwargs)
+        except APIException as exc:
+            headers = None
+            if getattr(exc, 'wait', None):
+                headers = {'Retry-After': '%d' % exc.wait}
+            return render({'detail': exc.detail}, status=exc.status_code,
+                          headers=headers)
+    return view
+
+
+async def viewset(viewset_class, request, action, **kwargs):
+    """
+    A viewset instance set up for ``action`` as the router would, after
+    the viewset's throttles let the request through. Catalogue reads are
+    public, so permissions are not run.
+    """
+    view = viewset_class(action_map={'get': action}, args=(), kwargs=kwargs,
+                         format_kwarg=None, headers={})
+    view.request = view.initialize_request(request)
+    # The same buckets as the sync route: async-products-list takes its
+    # tokens from products-list.
+    view.throttle_route = request.resolver_match.url_name.removeprefix(
+        'async-')
+    # Authenticating the user for their bucket may query.
+    await sync_to_async(view.check_throttles)(view.request)
+    return view
+
+
+async def cached(view, produce):
+    data, hit = await cache.aread_through(view.request, produce)
+    return render(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+
+async def represent(serializer):
+    if isinstance(serializer, ValuesSerializer):
+        return await serializer.adata()
+    return serializer.data
+
+
+async def serialize_list(view, queryset):
+    paginator = view.paginator
+    if paginator is None:
+        rows = [row async for row in queryset]
+        return await represent(view.get_serializer(rows, many=True))
+    page = await paginator.apaginate_queryset(queryset, view.request)
+    data = await represent(view.get_serializer(page, many=True))
+    return paginator.get_paginated_response(data).data
+
+
+async def get_object(queryset, pk):
+    try:
+        return await queryset.aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        raise NotFound()
+
+
+@async_endpoint
+async def product_list(request):
+    view = await viewset(ProductViewSet, request, 'list')
+
+    async def produce():
+        # Filter backends may query (filterset validation, category tree).
+        queryset = await sync_to_async(view.filter_queryset)(
+            view.get_queryset())
+        return await serialize_list(view, queryset)
+    return await cached(view, produce)
+
+
+@async_endpoint
+async def product_detail(request, pk):
+    view = await viewset(ProductViewSet, request, 'retrieve', pk=pk)
+
+    async def produce():
+        product = await get_object(view.get_queryset(), pk)
+        return await represent(view.get_serializer(product))
+    return await cached(view, produce)
+
+
+@async_endpoint
+async def product_reviews(request, pk):
+    view = await viewset(ProductViewSet, request, 'list_reviews', pk=pk)
+
+    async def produce():
+        if not await Product.objects.filter(pk=pk).aexists():
+            raise NotFound()
+        reviews = eager_load(Review.objects.filter(product_id=pk),
+                             ReviewReadSerializer)
+        return await represent(ReviewReadSerializer(
+            [review async for review in reviews], many=True))
+    return await cached(view, produce)
+
+
+@async_endpoint
+async def category_list(request):
+    view = await viewset(CategoryViewSet, request, 'list')
+    return render(await serialize_list(view, view.get_queryset()))
+
+
+@async_endpoint
+async def variant_list(request):
+    view = await viewset(ProductVarientViewSet, request, 'list')
+    queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+    return render(await serialize_list(view, queryset))
+
+
+@async_endpoint
+async def variant_detail(request, pk):
+    view = await viewset(ProductVarientViewSet, request, 'retrieve', pk=pk)
+    variant = await get_object(view.get_queryset(), pk)
+    return render(await represent(view.get_serializer(variant)))
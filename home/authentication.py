@@ -0,0 +1,135 @@
+"""
+JWT authentication without a user query per request.
+
+``CachedJWTAuthentication`` keeps the user a token resolves to in the cache
+for ``AUTH_USER_CACHE_TIMEOUT`` seconds: the fields ``request.user`` needs
+(``USER_FIELDS``) and a digest for the revocation check, never the password
+hash, as the cache is shared with Celery. Entries are tagged with a per-user
+version that every save or delete of the user moves forward (see
+``home.signals``), so a password change, a deactivation or a permission
+change takes effect on the next request. Updates that bypass signals
+(``QuerySet.update()``) are only picked up when the entry expires.
+
+``ClaimsJWTAuthentication`` goes further for views that opt in and show
+users only their own rows: reads are authenticated from the token claims
+(user id and staff flags, see ``ClaimsTokenObtainPairSerializer``) with one
+cache lookup and no query. The claims carry the user's version at login;
+once the user has changed since, the token is authenticated like
+``CachedJWTAuthentication`` does, so a deactivated or demoted user never
+reads with stale claims. Writes always resolve the user.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import (
+    JWTAuthentication, JWTStatelessUserAuthentication)
+from rest_framework_simplejwt.exceptions import (AuthenticationFailed,
+                                                 InvalidToken)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+KEY_PREFIX = 'auth:user'
+VERSION_CLAIM = 'auth_version'
+USER_FIELDS = ['id', 'username', 'is_active', 'is_staff', 'is_superuser']
+
+
+def _user_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+def _version_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}:version'
+
+
+def user_version(user_id):
+    """
+    Current version of the user ``user_id``, started if there is none.
+    """
+    key = _version_key(user_id)
+    # Seeded from the clock like the catalogue versions (home.cache), so
+    # an evicted counter never comes back at a version still cached.
+    cache.add(key, time.time_ns(), timeout=None)
+    return cache.get(key)
+
+
+def bump_user(user_id):
+    """
+    Drop the cached user ``user_id`` by moving its version forward.
+    """
+    user_version(user_id)
+    cache.incr(_version_key(user_id))
+
+
+def _cached_user(values):
+    """
+    The user as loaded with ``.only(*USER_FIELDS)``: other fields are read on
+    access, and ``save()`` writes back only these.
+    """
+    model = get_user_model()
+    names = [field.attname for field in model._meta.concrete_fields
+             if field.attname in values]
+    return model.from_db(DEFAULT_DB_ALIAS, names,
+                         [values[name] for name in names])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                "Token contained no recognizable user identification")
+
+        user_key, version_key = _user_key(user_id), _version_key(user_id)
+        entries = cache.get_many([user_key, version_key])
+        version = entries.get(version_key)
+        cached = entries.get(user_key)
+        if (version is not None and cached is not None
+                and cached[0] == version):
+            _, values, digest = cached
+            self.check_revoked(digest, validated_token)
+            return _cached_user(values)
+
+        if version is None:
+            version = user_version(user_id)
+        # Reads the user and runs the active and revocation checks. Should
+        # the user change meanwhile, the entry is stored under a version
+        # that is already stale.
+        user = super().get_user(validated_token)
+        digest = None
+        if api_settings.CHECK_REVOKE_TOKEN:
+            digest = get_md5_hash_password(user.password)
+        cache.set(user_key, (version, {name: getattr(user, name)
+                                       for name in USER_FIELDS}, digest),
+                  timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
+
+    def check_revoked(self, digest, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM) != digest:
+            raise AuthenticationFailed(
+                "The user's password has been changed.",
+                code='password_changed')
+
+
+class ClaimsJWTAuthentication(CachedJWTAuthentication):
+    """
+    Authenticates safe requests from the token claims, as a ``TokenUser``,
+    while the user is unchanged since the token was issued, and anything
+    else like ``CachedJWTAuthentication``. Only for views that need no more
+    than ``request.user.pk`` on reads and expose nothing privileged.
+    """
+    def authenticate(self, request):
+        if request.method not in SAFE_METHODS:
+            return super().authenticate(request)
+        authenticated = JWTStatelessUserAuthentication().authenticate(request)
+        if authenticated is None:
+            return None
+        user, token = authenticated
+        if token.get(VERSION_CLAIM) != cache.get(_version_key(user.pk)):
+            return super().authenticate(request)
+        return authenticated
@@ -0,0 +1,867 @@
+"""
+Micro-benchmarks for the hot paths of the shop, run with
+``python manage.py benchmark <name>``.
+
+Each benchmark seeds its own data inside a transaction that the command
+rolls back afterwards, so they can be pointed at a development database.
+"""
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.db.utils import load_backend
+from django.db.models import Avg, Q
+from django.core.mail.backends import locmem
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.urls import resolve
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.throttling import AnonRateThrottle
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .authentication import (CachedJWTAuthentication,
+                             ClaimsJWTAuthentication)
+from .categories import rebuild_paths
+from .loading import eager_load
+from .models import (Cart, CartItem, Category, Product, ProductVariant,
+                     Order, Review, Tag, Wishlist)
+from .pagination import keyset_filter
+from .pricing import touch_cart
+from .ratings import recalculate_ratings
+from .product_io import export_products, import_products
+from .rows import compiled
+from .search import refresh_search_vectors, search_products
+from .serializers import (ClaimsTokenObtainPairSerializer,
+                          OrderSerializer, ProductReadSerializer,
+                          ProductSerializer, ProductVarientReadSerializer,
+                          ProductVarientSerializer)
+from .stock import release_expired_holds
+from .tasks import refill_stock
+from .throttling import RedisBuckets, TokenBucketThrottle
+from .views import CartViewSet, OrderViewSet
+
+BENCHMARKS = {}
+
+WORDS = (
+    'alpha amber arctic azure bamboo basic blue bold bright canvas carbon '
+    'classic cloud cobalt compact copper cotton crimson crystal denim '
+    'desert eco electric ember emerald fleece forest frost golden granite '
+    'green harbor indigo iron ivory jade leather linen lunar maple marble '
+    'matte midnight mint modern navy nova ocean olive onyx orange pearl '
+    'pine pixel plum polar prime quartz rapid red retro river royal ruby '
+    'rustic sage sand scarlet silver slate smart solar sonic spark steel '
+    'stone storm summit sunset swift teal terra thunder titan urban velvet '
+    'vintage violet walnut wave white wild willow winter wood zen'
+).split()
+NOUNS = (
+    'backpack blender boots cable camera chair charger desk drone earbuds '
+    'headphones hoodie jacket kettle keyboard lamp laptop mixer monitor '
+    'mouse mug notebook phone printer router scarf shirt shoes sneakers '
+    'speaker tablet tent toaster watch wallet'
+).split()
+
+
+def benchmark(name):
+    """
+    Register ``func(stdout, **options)`` as a benchmark called ``name``.
+    """
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def timings(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    return {
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': percentile(0.50) * 1000,
+        'p95_ms': percentile(0.95) * 1000,
+        'p99_ms': percentile(0.99) * 1000,
+    }
+
+
+def report(stdout, label, samples, queries=None):
+    stats = summarize(samples)
+    line = (f"{label:<40} mean={stats['mean_ms']:8.2f}ms "
+            f"p50={stats['p50_ms']:8.2f}ms p95={stats['p95_ms']:8.2f}ms")
+    if queries is not None:
+        line += f" queries={queries}"
+    stdout.write(line)
+    return stats
+
+
+def count_queries(func):
+    with CaptureQueriesContext(connection) as captured:
+        func()
+    return len(captured.captured_queries)
+
+
+def peak_memory(func):
+    """
+    Peak Python heap allocated while running ``func``, in MiB.
+    """
+    # With DEBUG on, the query log would keep the SQL of every statement.
+    with override_settings(DEBUG=False):
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+
+
+def analyze(*models):
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+
+def plan_summary(queryset):
+    """
+    First node of the query plan, e.g. ``Limit`` / ``Index Scan using ...``.
+    """
+    lines = [line.strip(' ->') for line in queryset.explain().splitlines()]
+    nodes = [line.split('  (')[0] for line in lines
+             if line and not line.startswith(('Filter', 'Index Cond',
+                                              'Sort Key', 'Recheck'))]
+    return ' / '.join(nodes[:2])
+
+
+def seed_users(count, prefix='bench-user'):
+    return User.objects.bulk_create([
+        User(username=f'{prefix}-{i}') for i in range(count)
+    ])
+
+
+def product_name(rng):
+    return f'{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.choice(NOUNS)}'
+
+
+def seed_catalogue(products=1000, categories=20, variants_per_product=0,
+                   seed=0, batch_size=2000):
+    """
+    Bulk-insert a random catalogue and return the created categories.
+    """
+    rng = random.Random(seed)
+    categories = Category.objects.bulk_create([
+        Category(name=f'bench-category-{seed}-{i}',
+                 slug=f'bench-category-{seed}-{i}')
+        for i in range(categories)
+    ])
+    rebuild_paths()
+    for start in range(0, products, batch_size):
+        batch = Product.objects.bulk_create([
+            Product(
+                name=product_name(rng).title(),
+                slug=f'bench-product-{seed}-{i}',
+                category=rng.choice(categories),
+                description=' '.join(rng.choices(WORDS + NOUNS, k=20)),
+                price=Decimal(rng.randint(100, 100000)) / 100,
+            )
+            for i in range(start, min(start + batch_size, products))
+        ])
+        ProductVariant.objects.bulk_create([
+            ProductVariant(
+                product=product,
+                varient_name='Size',
+                varient_value=size,
+                price=product.price,
+                stock_count=rng.randint(0, 200),
+            )
+            for product in batch
+            for size in ('S', 'M', 'L', 'XL')[:variants_per_product]
+        ])
+    return categories
+
+
+@benchmark('search')
+def search_benchmark(stdout, size=20000, repeat=50, **options):
+    """
+    Product search: SearchFilter ILIKE scans versus the full-text index.
+
+    Runs single-term and two-term prefix queries against both.
+    """
+    seed_catalogue(products=size)
+    refresh_search_vectors()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE home_product')
+
+    rng = random.Random(1)
+    queries = [rng.choice(NOUNS)[:4] for _ in range(repeat)]
+    queries += [f'{rng.choice(WORDS)} {rng.choice(NOUNS)[:3]}'
+                for _ in range(repeat)]
+
+    def ilike(text):
+        condition = Q()
+        for term in text.split():
+            condition &= Q(name__icontains=term) | Q(
+                description__icontains=term)
+        return list(Product.objects.filter(condition)
+                    .order_by('-created_at')[:20])
+
+    terms = iter(queries * 2)
+    report(stdout, f'SearchFilter icontains ({size} products)',
+           timings(lambda: ilike(next(terms)), len(queries)))
+    terms = iter(queries * 2)
+    report(stdout, f'full-text search top-20 ({size} products)',
+           timings(lambda: search_products(next(terms)), len(queries)))
+
+
+@benchmark('indexes')
+def index_benchmark(stdout, size=50000, repeat=20, **options):
+    """
+    Query plans and timings of the hot lookups with and without the index
+    plan declared in the models' Meta.
+    """
+    rng = random.Random(2)
+    categories = seed_catalogue(products=size, categories=50)
+    users = seed_users(500)
+    products = list(Product.objects.values_list('pk', flat=True))
+    Order.objects.bulk_create([
+        Order(user=rng.choice(users),
+              order_status=rng.choice(['Pending', 'Shipped', 'Delivered']))
+        for _ in range(size)
+    ], batch_size=5000)
+    pairs = {(rng.choice(products), rng.choice(users).pk)
+             for _ in range(size)}
+    Review.objects.bulk_create([
+        Review(product_id=product, user_id=user, rating=5, comment='ok')
+        for product, user in pairs
+    ], batch_size=5000)
+    Wishlist.objects.bulk_create([
+        Wishlist(product_id=product, user_id=user) for product, user in pairs
+    ], batch_size=5000)
+
+    category = categories[7]
+    user = users[3]
+    product, reviewer = next(iter(pairs))
+    pivot = Product.objects.order_by('price', 'id')[size // 2]
+    name = Product.objects.values_list('name', flat=True)[size // 3]
+    queries = {
+        'product list page': lambda: Product.objects.order_by(
+            '-created_at', '-id')[:20],
+        'category page': lambda: Product.objects.filter(
+            category=category).order_by('-created_at', '-id')[:20],
+        'active category page': lambda: Product.objects.filter(
+            category=category, is_active=True).order_by(
+            '-created_at', '-id')[:20],
+        'deep price page (keyset)': lambda: Product.objects.filter(
+            keyset_filter(['price', 'id'], [pivot.price, pivot.id])
+        ).order_by('price', 'id')[:20],
+        'product by name': lambda: Product.objects.filter(name=name),
+        'user orders page': lambda: Order.objects.filter(
+            user=user).order_by('-created_at')[:20],
+        'user orders by status': lambda: Order.objects.filter(
+            user=user, order_status='Pending'),
+        'review exists': lambda: Review.objects.filter(
+            product_id=product, user_id=reviewer),
+        'wishlist exists': lambda: Wishlist.objects.filter(
+            user_id=reviewer, product_id=product),
+    }
+
+    def run(phase):
+        analyze(Product, Order, Review, Wishlist)
+        stdout.write(f'-- {phase}')
+        for label, query in queries.items():
+            samples = timings(lambda: list(query()), repeat)
+            report(stdout, label, samples)
+            stdout.write(f'   plan: {plan_summary(query())}')
+
+    run('with index plan')
+
+    # Back to the previous schema: only the single-column indexes Django
+    # creates for foreign keys, no composite/partial indexes or constraints.
+    with connection.schema_editor() as editor:
+        # Fire the deferred FK checks of the seeded rows before altering.
+        editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        for model in (Product, Order, Review, Wishlist):
+            for index in model._meta.indexes:
+                if index.name != 'product_search_vector_gin':
+                    editor.remove_index(model, index)
+            for constraint in model._meta.constraints:
+                editor.remove_constraint(model, constraint)
+        for model, column in ((Product, 'category_id'), (Order, 'user_id'),
+                              (Review, 'product_id'),
+                              (Wishlist, 'user_id')):
+            table = model._meta.db_table
+            editor.execute(f'CREATE INDEX bench_{table}_{column} '
+                           f'ON {table} ({column})')
+    run('without index plan')
+
+
+@benchmark('refill')
+def refill_benchmark(stdout, size=1000000, repeat=3, **options):
+    """
+    refill_stock: per-row save() loop versus chunked set-based UPDATEs.
+    """
+    seed_catalogue(products=1000)
+    table = ProductVariant._meta.db_table
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    with connection.cursor() as cursor:
+        # Seed in SQL: a million bulk_create() objects would dominate the run.
+        cursor.execute(
+            f'INSERT INTO {table} (product_id, varient_name, varient_value, '
+            f'price, stock_count) '
+            f'SELECT (%s::bigint[])[1 + n %% %s], %s, n::text, 10, 0 '
+            f'FROM generate_series(1, %s) AS n',
+            [product_ids, len(product_ids), 'Size', size],
+        )
+    analyze(ProductVariant)
+
+    def reset(refilled_only=True):
+        # Refilled rows are the only ones at 100 (the seed tops out at 39).
+        where = 'WHERE stock_count = 100' if refilled_only else ''
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {table} SET stock_count = id % 40 {where}')
+
+    # The loop is far too slow for the whole table; time a sample and
+    # extrapolate to the number of low-stock rows.
+    reset(refilled_only=False)
+    low = ProductVariant.objects.filter(stock_count__lt=10).count()
+    sample = min(low, 20000)
+
+    def legacy():
+        for variant in ProductVariant.objects.filter(
+                stock_count__lt=10)[:sample]:
+            variant.stock_count = 100
+            variant.save()
+
+    samples = timings(legacy, 1)
+    stdout.write(f'{low} low-stock variants out of {size}')
+    report(stdout, f'save() loop, {sample} rows', samples)
+    stdout.write(f'   extrapolated to {low} rows: '
+                 f'{samples[0] * low / sample:.1f}s')
+
+    for chunk_size in (10000, 100000):
+        samples = []
+        for _ in range(repeat):
+            reset()
+            samples += timings(lambda: refill_stock.apply(
+                kwargs={'chunk_size': chunk_size}).get(), 1)
+        report(stdout, f'set-based, chunk_size={chunk_size}', samples)
+
+
+@benchmark('connections')
+def connection_benchmark(stdout, size=None, repeat=500, **options):
+    """
+    Cost of a request's database connection: connect per request (the
+    default CONN_MAX_AGE=0), persistent with health checks, and pooled.
+    """
+    base = dict(connections['default'].settings_dict)
+    backend = load_backend(base['ENGINE'])
+    profiles = {
+        'new connection per request': dict(
+            CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False),
+        'persistent + health checks': dict(
+            CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True),
+        'psycopg pool': dict(
+            CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False,
+            OPTIONS=dict(base['OPTIONS'],
+                         pool={'min_size': 1, 'max_size': 2})),
+    }
+    for label, overrides in profiles.items():
+        # A private connection, outside the benchmark's transaction.
+        wrapper = backend.DatabaseWrapper(dict(base, **overrides),
+                                          alias=f'bench-{label}')
+
+        backends = set()
+
+        def request():
+            # What the request_started/request_finished signals do.
+            wrapper.close_if_unusable_or_obsolete()
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                backends.add(cursor.fetchone()[0])
+            wrapper.close_if_unusable_or_obsolete()
+
+        report(stdout, label, timings(request, repeat))
+        stdout.write(f'   server processes used: {len(backends)}')
+        wrapper.close()
+        if overrides.get('OPTIONS', {}).get('pool'):
+            wrapper.close_pool()
+
+
+@benchmark('cart-summary')
+def cart_summary_benchmark(stdout, size=200, repeat=50, **options):
+    """
+    /api/cart/summary/ latency for 1-200 line carts, cold and cached.
+    """
+    seed_catalogue(products=size, variants_per_product=1)
+    user = seed_users(1, prefix='bench-cart')[0]
+    cart = Cart.objects.create(user=user)
+    variants = list(ProductVariant.objects.order_by('-pk')[:size])
+    view = CartViewSet.as_view({'get': 'summary'})
+    factory = APIRequestFactory()
+
+    def get_summary():
+        request = factory.get('/api/cart/summary/')
+        force_authenticate(request, user)
+        return view(request)
+
+    for lines in sorted({1, 10, 50, size}):
+        CartItem.objects.filter(cart=cart).delete()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_variant=variant, quantity=2,
+                     price_at_time=variant.price)
+            for variant in variants[:lines]
+        ])
+        cold = []
+        for _ in range(repeat):
+            touch_cart(cart.pk)
+            cold += timings(get_summary, 1)
+        queries = count_queries(get_summary)
+        report(stdout, f'{lines:>3} lines, cold', cold)
+        report(stdout, f'{lines:>3} lines, cached', timings(get_summary,
+                                                            repeat),
+               queries=queries)
+
+
+@benchmark('cart-bulk')
+def cart_bulk_benchmark(stdout, size=20, repeat=20, **options):
+    """
+    Importing a ``size``-line basket: one /api/cart/add/ call per line
+    against a single /api/cart/bulk/ call.
+    """
+    seed_catalogue(products=size, variants_per_product=1)
+    user = seed_users(1, prefix='bench-bulk')[0]
+    variants = list(ProductVariant.objects.order_by('-pk')[:size])
+    ProductVariant.objects.filter(pk__in=[v.pk for v in variants]).update(
+        stock_count=10 ** 6)
+    add_item = CartViewSet.as_view({'post': 'add_item'})
+    bulk = CartViewSet.as_view({'post': 'bulk'})
+    factory = APIRequestFactory()
+
+    def call(view, data):
+        request = factory.post('/api/cart/', data, format='json')
+        force_authenticate(request, user)
+        response = view(request)
+        assert response.status_code == 200, response.data
+
+    def one_by_one():
+        for variant in variants:
+            call(add_item, {'product_variant': variant.pk, 'quantity': 1})
+
+    def in_bulk():
+        call(bulk, {'items': [{'product_variant': variant.pk,
+                               'quantity': 1} for variant in variants]})
+
+    for label, run in (('add_item per line', one_by_one),
+                       ('bulk', in_bulk)):
+        queries = count_queries(run)
+        report(stdout, label, timings(run, repeat), queries=queries)
+
+
+@benchmark('product-import')
+def product_import_benchmark(stdout, size=100000, repeat=1, **options):
+    """
+    Streaming product import and export of ``size`` NDJSON products,
+    against the per-product save path; peak Python memory is measured in a
+    separate traced pass and should not grow with the file.
+    """
+    rng = random.Random(17)
+    category = seed_catalogue(products=0, categories=1)[0]
+    Tag.objects.bulk_create([Tag(name=word, slug=word) for word in WORDS],
+                            ignore_conflicts=True)
+
+    def lines(run, count):
+        for n in range(count):
+            yield json.dumps({
+                'name': product_name(rng), 'slug': f'bench-{run}-{n}',
+                'category': category.slug, 'price': '19.99',
+                'tags': rng.sample(WORDS, 2),
+                'variants': [{'name': 'Size', 'value': size_name,
+                              'stock_count': 10}
+                             for size_name in ('S', 'M', 'L')],
+            }) + '\n'
+
+    def save_each(count):
+        for line in lines('save', count):
+            record = json.loads(line)
+            product = Product.objects.create(
+                name=record['name'], slug=record['slug'],
+                category=category, price=Decimal(record['price']))
+            for variant in record['variants']:
+                ProductVariant.objects.create(
+                    product=product, varient_name=variant['name'],
+                    varient_value=variant['value'], price=product.price,
+                    stock_count=variant['stock_count'])
+            product.tags.add(*Tag.objects.filter(name__in=record['tags']))
+
+    sample = min(size, 500)
+    samples = timings(lambda: save_each(sample), 1)
+    report(stdout, f'save() per product, {sample} products', samples)
+    stdout.write(f'   extrapolated to {size} products: '
+                 f'{samples[0] * size / sample:.1f}s')
+
+    for count in sorted({size // 10, size}):
+        run = f'{count}'
+        samples = timings(
+            lambda: import_products(lines(run, count), 'ndjson'), 1)
+        peak = peak_memory(
+            lambda: import_products(lines(f'{run}-traced', count), 'ndjson'))
+        report(stdout, f'import_products, {count} products', samples)
+        stdout.write(f'   peak memory {peak:.1f} MiB')
+
+    def export():
+        return sum(len(chunk) for chunk in export_products('ndjson'))
+
+    exported = Product.objects.count()
+    samples = timings(export, 1)
+    peak = peak_memory(export)
+    report(stdout, f'export_products, {exported} products', samples)
+    stdout.write(f'   peak memory {peak:.1f} MiB')
+
+
+@benchmark('stream')
+def stream_benchmark(stdout, size=100000, repeat=1, **options):
+    """
+    Staff export of every order: the whole list serialized in memory
+    against the streamed NDJSON list, at growing row counts.
+    """
+    user = seed_users(1, prefix='bench-stream')[0]
+    User.objects.filter(pk=user.pk).update(is_staff=True)
+    user.is_staff = True
+    view = OrderViewSet.as_view({'get': 'list'})
+    factory = APIRequestFactory()
+
+    def in_memory():
+        queryset = Order.objects.order_by('-created_at')
+        return JSONRenderer().render(
+            OrderSerializer(queryset, many=True).data)
+
+    def streamed():
+        request = factory.get('/api/orders/', {'stream': '1'})
+        force_authenticate(request, user)
+        return sum(len(chunk) for chunk in view(request).streaming_content)
+
+    seeded = 0
+    for count in sorted({size // 100, size // 10, size}):
+        while seeded < count:
+            batch = min(10000, count - seeded)
+            Order.objects.bulk_create([
+                Order(user=user, subtotal=Decimal('10.00'),
+                      grand_total=Decimal('10.00'), item_count=1)
+                for _ in range(batch)])
+            seeded += batch
+        for label, func in (('in memory', in_memory),
+                            ('streamed', streamed)):
+            samples = timings(func, repeat)
+            peak = peak_memory(func)
+            report(stdout, f'{count:>7} orders, {label}', samples)
+            stdout.write(f'   peak memory {peak:.1f} MiB')
+
+
+@benchmark('serializers')
+def serializers_benchmark(stdout, size=10000, repeat=5, **options):
+    """
+    Rendering ``size`` products (two variants each) and their variants with
+    the model serializers against the .values() read serializers, with the
+    queries and with the rows already loaded.
+    """
+    seed_catalogue(products=size, variants_per_product=2)
+    cases = (
+        ('products', Product.objects.filter(slug__startswith='bench-'),
+         ProductSerializer, ProductReadSerializer),
+        ('variants', ProductVariant.objects.filter(
+            product__slug__startswith='bench-'),
+         ProductVarientSerializer, ProductVarientReadSerializer),
+    )
+    for label, queryset, model_serializer, read_serializer in cases:
+        queryset = queryset.order_by('pk')
+        rows = len(queryset)
+        instances = list(eager_load(queryset, model_serializer))
+        values = list(eager_load(queryset, read_serializer))
+        fields = compiled(read_serializer.model_serializer)
+        children = fields.fetch(values)
+        for name, func in (
+            ('model serializer',
+             lambda: model_serializer(eager_load(queryset, model_serializer),
+                                      many=True).data),
+            ('values serializer',
+             lambda: read_serializer(eager_load(queryset, read_serializer),
+                                     many=True).data),
+            ('model serializer, loaded',
+             lambda: model_serializer(instances, many=True).data),
+            ('values serializer, loaded',
+             lambda: fields.render(values, children)),
+        ):
+            samples = timings(func, repeat)
+            report(stdout, f'{rows} {label}, {name}', samples)
+            stdout.write(f'   {rows / statistics.median(samples):,.0f} '
+                         f'rows/s')
+
+
+@benchmark('auth')
+def auth_benchmark(stdout, size=None, repeat=2000, **options):
+    """
+    Per-request JWT authentication: simplejwt's user query, the cached
+    user, and the claims-only user of ClaimsJWTAuthentication reads.
+    """
+    user = User.objects.create_user(f'bench-auth-{time.time_ns()}')
+    token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+    request = APIRequestFactory().get(
+        '/', HTTP_AUTHORIZATION=f'Bearer {token}')
+    for label, authentication in (
+        ('JWTAuthentication', JWTAuthentication()),
+        ('CachedJWTAuthentication', CachedJWTAuthentication()),
+        ('ClaimsJWTAuthentication (read)', ClaimsJWTAuthentication()),
+    ):
+        authentication.authenticate(request)
+        queries = count_queries(lambda: authentication.authenticate(request))
+        samples = timings(lambda: authentication.authenticate(request),
+                          repeat)
+        report(stdout, label, samples, queries)
+
+
+@benchmark('throttle')
+def throttle_benchmark(stdout, size=None, repeat=5000, **options):
+    """
+    Per-request cost of TokenBucketThrottle, with in-process buckets and
+    with Redis when THROTTLE_URL (or THROTTLE_REDIS_URL) reaches one, next
+    to DRF's AnonRateThrottle, whose request log grows with the rate.
+    """
+    rate = '100000/hour'
+    user = User.objects.create_user(f'bench-throttle-{time.time_ns()}')
+    http_request = APIRequestFactory().get('/api/products/')
+    http_request.resolver_match = resolve('/api/products/')
+
+    def request(authenticated):
+        drf_request = Request(http_request)
+        if authenticated:
+            drf_request.user = user
+        return drf_request
+
+    class DRFAnonThrottle(AnonRateThrottle):
+        pass
+
+    DRFAnonThrottle.rate = rate
+    stores = [('in-process', None)]
+    url = os.getenv('THROTTLE_URL', settings.THROTTLE_REDIS_URL)
+    if url:
+        try:
+            RedisBuckets(url).client.ping()
+            stores.append(('redis', url))
+        except redis.RedisError:
+            stdout.write(f'Redis unreachable at {url}, skipped')
+    rates = {'default': {'user': rate, 'anon': rate}}
+    for store, url in stores:
+        with override_settings(THROTTLE_RATES=rates, THROTTLE_REDIS_URL=url):
+            for scope, authenticated in (('anon', False), ('user', True)):
+                samples = timings(
+                    lambda: TokenBucketThrottle().allow_request(
+                        request(authenticated), None), repeat)
+                report(stdout, f'token bucket, {store}, {scope}', samples)
+    samples = timings(lambda: DRFAnonThrottle().allow_request(
+        request(False), None), repeat)
+    report(stdout, f'AnonRateThrottle, {repeat} logged requests', samples)
+
+
+class SlowEmailBackend(locmem.EmailBackend):
+    """
+    In-memory mail with the round trip of a mail server, for ``checkout``.
+    """
+    latency = 0.05
+
+    def send_messages(self, messages):
+        time.sleep(self.latency)
+        return super().send_messages(messages)
+
+
+@benchmark('checkout')
+def checkout_benchmark(stdout, size=10, repeat=50, **options):
+    """
+    /api/orders/create/ latency for a ``size``-line cart with the order
+    post-processing run inline (eager tasks) and queued to the broker,
+    with instant mail and with a 50ms mail server round trip.
+    """
+    seed_catalogue(products=size, variants_per_product=1)
+    user = seed_users(1, prefix=f'bench-checkout-{time.time_ns()}')[0]
+    User.objects.filter(pk=user.pk).update(is_superuser=True,
+                                           email='bench@example.com')
+    user.refresh_from_db()
+    cart = Cart.objects.create(user=user)
+    variants = list(ProductVariant.objects.order_by('-pk')[:size])
+    ProductVariant.objects.filter(pk__in=[v.pk for v in variants]).update(
+        stock_count=10 ** 6)
+    view = OrderViewSet.as_view({'post': 'create_order'})
+    factory = APIRequestFactory()
+
+    def checkout():
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_variant=variant, quantity=1,
+                     price_at_time=variant.price)
+            for variant in variants
+        ])
+        request = factory.post('/api/orders/create/')
+        force_authenticate(request, user)
+        start = time.perf_counter()
+        # The benchmark runs in a transaction that is rolled back, so the
+        # on-commit dispatch is run here, as part of the request.
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            response = view(request)
+        elapsed = time.perf_counter() - start
+        assert response.status_code == 200, response.data
+        return elapsed
+
+    for mail, backend in (
+        ('instant mail', 'django.core.mail.backends.locmem.EmailBackend'),
+        ('50ms mail', 'home.benchmarks.SlowEmailBackend'),
+    ):
+        for mode, always_eager in (('inline', True), ('queued', False)):
+            # Celery reads its configuration from the Django settings.
+            with override_settings(EMAIL_BACKEND=backend,
+                                   CELERY_TASK_ALWAYS_EAGER=always_eager):
+                checkout()
+                report(stdout, f'{mode}, {mail}',
+                       [checkout() for _ in range(repeat)])
+
+
+@benchmark('cart-holds')
+def cart_holds_benchmark(stdout, size=1000000, repeat=3, **options):
+    """
+    release_expired_holds over ``size`` cart lines, 1% of them expired and
+    half already released, with and without the partial expiry index.
+
+    Everything runs in one rolled back transaction, so the swept rows stay
+    behind as dead index entries that later batches and repeats have to
+    step over; a real sweep commits each batch and is faster.
+    """
+    seed_catalogue(products=1000, variants_per_product=1)
+    variant_ids = list(ProductVariant.objects.values_list('pk', flat=True))
+    carts = size // 10
+    prefix = f'bench-holds-{time.time_ns()}'
+    user_table, cart_table = User._meta.db_table, Cart._meta.db_table
+    line_table = CartItem._meta.db_table
+    with connection.cursor() as cursor:
+        # Seed in SQL: bulk_create() of a million lines would dominate.
+        cursor.execute(
+            f'INSERT INTO {user_table} (password, is_superuser, username, '
+            f'first_name, last_name, email, is_staff, is_active, '
+            f'date_joined) '
+            f"SELECT '', false, %s || n, '', '', '', false, true, now() "
+            f'FROM generate_series(1, %s) AS n',
+            [prefix, carts])
+        cursor.execute(
+            f'INSERT INTO {cart_table} (user_id, created_at, updated_at) '
+            f'SELECT id, now(), now() FROM {user_table} '
+            f'WHERE username LIKE %s',
+            [f'{prefix}%'])
+        cursor.execute(
+            f'SELECT min(id) FROM {cart_table} c WHERE EXISTS ('
+            f'SELECT 1 FROM {user_table} u WHERE u.id = c.user_id '
+            f'AND u.username LIKE %s)',
+            [f'{prefix}%'])
+        first_cart = cursor.fetchone()[0]
+        cursor.execute(
+            f'INSERT INTO {line_table} (cart_id, product_variant_id, '
+            f'quantity, price_at_time, reserved_until) '
+            f'SELECT %s + n / 10, (%s::bigint[])[1 + n %% %s], 1, 10, '
+            f'NULL FROM generate_series(0, %s - 1) AS n',
+            [first_cart, variant_ids, len(variant_ids), carts * 10])
+
+    with connection.cursor() as cursor:
+        # Half of the lines are released, the others expire within a day.
+        cursor.execute(
+            f'UPDATE {line_table} SET reserved_until = CASE '
+            f'WHEN id %% 2 = 1 THEN NULL '
+            f"ELSE now() + (1 + id %% 24) * interval '1 hour' END "
+            f'WHERE cart_id >= %s',
+            [first_cart])
+
+    def reset():
+        # Every 100th line expired a minute ago.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {line_table} '
+                f"SET reserved_until = now() - interval '1 minute' "
+                f'WHERE cart_id >= %s AND id %% 100 = 0',
+                [first_cart])
+
+    def run(phase):
+        reset()
+        analyze(CartItem, ProductVariant)
+        expired = CartItem.objects.filter(
+            reserved_until__lt=timezone.now()).order_by('reserved_until')
+        count = expired.count()
+        stdout.write(f'-- {phase}')
+        stdout.write(f'   plan: {plan_summary(expired[:5000])}')
+        samples = []
+        for _ in range(repeat):
+            reset()
+            samples += timings(lambda: release_expired_holds(5000), 1)
+        reset()
+        report(stdout, f'sweep {count} of {size} lines', samples,
+               count_queries(lambda: release_expired_holds(5000)))
+
+    run('with partial index')
+    with connection.schema_editor() as editor:
+        editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        for index in CartItem._meta.indexes:
+            editor.remove_index(CartItem, index)
+    run('without index')
+
+
+@benchmark('ratings')
+def ratings_benchmark(stdout, size=50000, repeat=20, **options):
+    """
+    Top-rated product page from the stored aggregates versus an aggregate
+    over the reviews, and the drift repair of recalculate_ratings.
+    """
+    seed_catalogue(products=size)
+    users = seed_users(20, prefix=f'bench-rater-{time.time_ns()}')
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    user_ids = [user.pk for user in users]
+    with connection.cursor() as cursor:
+        # Ten reviews per product, in SQL and so without the signals.
+        cursor.execute(
+            f'INSERT INTO {Review._meta.db_table} (product_id, user_id, '
+            f'rating, comment, created_at, updated_at) '
+            f'SELECT (%s::bigint[])[1 + n %% %s], '
+            f'(%s::bigint[])[1 + n / %s], 1 + (n * 7 + n / %s) %% 5, '
+            f"'ok', now(), now() FROM generate_series(0, %s - 1) AS n",
+            [product_ids, size, user_ids, size, size, size * 10])
+    analyze(Review)
+
+    def repair():
+        for start in range(0, size, 1000):
+            recalculate_ratings(product_ids[start:start + 1000])
+
+    # The reviews were inserted behind the signals' back: every product
+    # has drifted on the first pass, none on the second.
+    report(stdout, f'repair, {size} drifted products', timings(repair, 1))
+    report(stdout, f'repair, {size} products, no drift', timings(repair, 1))
+    analyze(Product)
+    queries = {
+        'annotated Avg(reviews__rating)': lambda: Product.objects.annotate(
+            average=Avg('reviews__rating')).order_by('-average', '-id')[:20],
+        'stored rating_average': lambda: Product.objects.order_by(
+            '-rating_average', '-id')[:20],
+    }
+    for label, query in queries.items():
+        report(stdout, label, timings(lambda: list(query()), repeat))
+        stdout.write(f'   plan: {plan_summary(query())}')
@@ -0,0 +1,180 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from .models import Category
+
+KEY_PREFIX = 'catalogue'
+ALL = 'all'
+STATS_KEYS = {
+    'hits': f'{KEY_PREFIX}:stats:hits',
+    'misses': f'{KEY_PREFIX}:stats:misses',
+}
+
+
+def category_namespace(category_id):
+    return f'category:{category_id}'
+
+
+def _version_key(namespace):
+    return f'{KEY_PREFIX}:version:{namespace}'
+
+
+def get_version(namespace):
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted counter can never fall back to a
+        # version whose pages are still cached.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _changed_key(namespace):
+    return f'{KEY_PREFIX}:changed:{namespace}'
+
+
+def version_state(namespace):
+    """
+    Version of ``namespace`` and the time (whole seconds) it last moved, in
+    one cache read.
+    """
+    keys = [_version_key(namespace), _changed_key(namespace)]
+    values = cache.get_many(keys)
+    if len(values) < len(keys):
+        # Nothing is known about earlier changes; date them now.
+        cache.add(keys[1], int(time.time()), timeout=None)
+        return get_version(namespace), cache.get(keys[1])
+    return values[keys[0]], values[keys[1]]
+
+
+def bump_versions(*namespaces):
+    """
+    Invalidate every cached page of the given namespaces by moving their
+    version counters forward. Old entries are never read again and simply
+    age out of the cache.
+    """
+    # The change time moves first: a reader in between sees a newer date
+    # with the old version, which only costs it a full response.
+    changed = int(time.time())
+    cache.set_many({_changed_key(namespace): changed
+                    for namespace in namespaces}, timeout=None)
+    for namespace in set(namespaces):
+        key = _version_key(namespace)
+        # add() is a no-op when the counter exists, so concurrent bumps
+        # never reset it; incr() is atomic in Redis.
+        cache.add(key, time.time_ns(), timeout=None)
+        cache.incr(key)
+
+
+def bump_category(*category_ids):
+    bump_versions(ALL, *(category_namespace(pk) for pk in category_ids
+                         if pk is not None))
+
+
+def bump_catalogue():
+    """
+    Invalidate every catalogue namespace, for set-based updates that bypass
+    model signals.
+    """
+    bump_category(*Category.objects.values_list('pk', flat=True))
+
+
+def _count(stat):
+    key = STATS_KEYS[stat]
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+
+
+def stats():
+    """
+    Return the catalogue cache hit/miss counters and the hit ratio.
+    """
+    values = cache.get_many(STATS_KEYS.values())
+    hits = values.get(STATS_KEYS['hits'], 0)
+    misses = values.get(STATS_KEYS['misses'], 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
+
+
+def reset_stats():
+    cache.delete_many(STATS_KEYS.values())
+
+
+def request_namespace(request):
+    """
+    Listings filtered by ``category`` only depend on that category; anything
+    else (unfiltered lists, details, reviews) depends on the whole catalogue.
+    """
+    category = request.query_params.get('category')
+    if category:
+        return category_namespace(category)
+    return ALL
+
+
+def make_key(request, namespace):
+    params = sorted(
+        (name, sorted(values))
+        for name, values in request.query_params.lists()
+    )
+    raw = f'{request.get_host()}{request.path}|{params}'
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    version = get_version(namespace)
+    return f'{KEY_PREFIX}:{namespace}:{version}:{digest}'
+
+
+def catalogue_cached(view_method):
+    """
+    Read-through cache for catalogue ``GET`` handlers.
+
+    Successful responses are stored under a key built from the request path,
+    its query parameters (filters, search, ordering, cursor) and the current
+    version of the namespace they belong to; ``X-Cache`` reports hit or miss.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = make_key(request, request_namespace(request))
+        data = cache.get(key)
+        if data is not None:
+            _count('hits')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        _count('misses')
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data,
+                      timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+def _lookup(request):
+    key = make_key(request, request_namespace(request))
+    data = cache.get(key)
+    _count('hits' if data is not None else 'misses')
+    return key, data
+
+
+async def aread_through(request, produce):
+    """
+    Async counterpart of ``catalogue_cached`` for the ``home.async_views``
+    handlers: return ``(data, hit)``, awaiting ``produce()`` on a miss.
+    The version, entry and counter lookups share one thread hop.
+    """
+    key, data = await sync_to_async(_lookup)(request)
+    if data is not None:
+        return data, True
+    data = await produce()
+    await cache.aset(key, data, timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+    return data, False
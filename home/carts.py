@@ -0,0 +1,97 @@
+"""
+Bulk cart mutations: many lines changed with a fixed number of queries.
+"""
+from django.db import IntegrityError, transaction
+
+from .models import CartItem, ProductVariant
+from .orders import CartChanged
+from .pricing import touch_cart, unit_price
+from .stock import NotEnoughStock, adjust_stock, hold_expiry
+
+
+class UnknownVariants(Exception):
+    """
+    Some requested product variants do not exist; ``args[0]`` lists them.
+    """
+
+
+def apply_operations(cart, quantities, replace=False):
+    """
+    Change several lines of ``cart`` at once, all or nothing.
+
+    ``quantities`` maps product variant ids to the units to add to their
+    line or, with ``replace``, to the line's new quantity (0 removes it).
+    Stock is reserved or returned for the difference only, counting a
+    line whose hold expired (see ``home.stock.release_expired_holds``) as
+    holding nothing; changed lines hold their stock for another
+    ``CART_HOLD_TIMEOUT``. Lines are priced by ``home.pricing``.
+
+    Queries do not grow with the number of lines: one read of the variants,
+    one locking read of the affected lines, one stock update, then at most
+    one insert, one update and one delete of lines and a touch of the cart.
+    Returns the affected lines still in the cart, by variant id.
+    """
+    variants = (
+        ProductVariant.objects.select_related('product')
+        .only('price', 'stock_count', 'product__discount_price')
+        .in_bulk(quantities)
+    )
+    missing = sorted(set(quantities) - set(variants))
+    if missing:
+        raise UnknownVariants(missing)
+    try:
+        with transaction.atomic():
+            lines = {
+                line.product_variant_id: line
+                for line in cart.items.select_for_update().filter(
+                    product_variant_id__in=quantities)
+            }
+            current = {pk: lines[pk].quantity if pk in lines else 0
+                       for pk in quantities}
+            reserved = {
+                pk: current[pk]
+                if pk in lines and lines[pk].reserved_until else 0
+                for pk in quantities
+            }
+            wanted = {pk: quantity if replace else current[pk] + quantity
+                      for pk, quantity in quantities.items()}
+            deltas = {pk: wanted[pk] - reserved[pk] for pk in quantities}
+            if not adjust_stock(deltas):
+                # The stock read above may be stale; it only names the
+                # culprits.
+                short = [pk for pk, delta in deltas.items()
+                         if delta > variants[pk].stock_count]
+                raise NotEnoughStock(
+                    sorted(short or [pk for pk, delta in deltas.items()
+                                     if delta > 0]))
+
+            created, changed, removed = [], [], []
+            reserved_until = hold_expiry()
+            for pk, quantity in wanted.items():
+                price = unit_price(variants[pk])
+                line = lines.get(pk)
+                if line is None:
+                    if quantity:
+                        created.append(CartItem(
+                            cart=cart, product_variant_id=pk,
+                            quantity=quantity, price_at_time=price,
+                            reserved_until=reserved_until))
+                elif not quantity:
+                    removed.append(line.pk)
+                else:
+                    line.quantity = quantity
+                    line.price_at_time = price
+                    line.reserved_until = reserved_until
+                    changed.append(line)
+            if created:
+                CartItem.objects.bulk_create(created)
+            if changed:
+                CartItem.objects.bulk_update(
+                    changed, ['quantity', 'price_at_time', 'reserved_until'])
+            if removed:
+                CartItem.objects.filter(pk__in=removed).delete()
+            touch_cart(cart.pk)
+    except IntegrityError:
+        # A concurrent request created one of the new lines first.
+        raise CartChanged
+    return {line.product_variant_id: line for line in created + changed}
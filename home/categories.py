@@ -0,0 +1,100 @@
+"""
+The category taxonomy on top of ``Category.path``.
+
+``category_tree`` keeps the whole taxonomy in process memory and rebuilds
+it when the shared ``category-tree`` version is bumped, so workers stay in
+step without reading the categories table on every request.
+"""
+from rest_framework.filters import BaseFilterBackend
+
+from . import cache
+from .models import Category
+
+TREE_NAMESPACE = 'category-tree'
+
+_local = {'version': None, 'tree': None}
+
+
+def rebuild_paths():
+    """
+    Recompute every ``Category.path`` from the ``parent`` links, for rows
+    written without ``save()`` (``bulk_create``/``bulk_update``).
+    """
+    categories = list(Category.objects.only('pk', 'parent_id', 'path'))
+    by_pk = {category.pk: category for category in categories}
+    paths = {}
+
+    def path_of(category):
+        if category.pk not in paths:
+            parent = by_pk.get(category.parent_id)
+            prefix = path_of(parent) if parent else ''
+            paths[category.pk] = f'{prefix}{category.pk}/'
+        return paths[category.pk]
+
+    changed = []
+    for category in categories:
+        path = path_of(category)
+        if category.path != path:
+            category.path = path
+            changed.append(category)
+    Category.objects.bulk_update(changed, ['path'], batch_size=1000)
+    invalidate_tree()
+    return len(changed)
+
+
+def build_tree():
+    tree = {}
+    for row in Category.objects.order_by('path').values(
+            'id', 'slug', 'name', 'parent_id', 'path'):
+        tree[row['slug']] = dict(row, children=[])
+    by_pk = {node['id']: node for node in tree.values()}
+    for node in tree.values():
+        parent = by_pk.get(node['parent_id'])
+        if parent is not None:
+            parent['children'].append(node['slug'])
+    return tree
+
+
+def category_tree():
+    """
+    ``{slug: {'id', 'slug', 'name', 'parent_id', 'path', 'children'}}`` for
+    every category, with children listed by slug.
+    """
+    version = cache.get_version(TREE_NAMESPACE)
+    if _local['version'] != version:
+        _local['tree'] = build_tree()
+        _local['version'] = version
+    return _local['tree']
+
+
+def invalidate_tree():
+    cache.bump_versions(TREE_NAMESPACE)
+
+
+def descendant_ids(slug):
+    """
+    Primary keys of the category ``slug`` and everything below it.
+    """
+    tree = category_tree()
+    node = tree.get(slug)
+    if node is None:
+        return []
+    return [other['id'] for other in tree.values()
+            if other['path'].startswith(node['path'])]
+
+
+class CategoryTreeFilter(BaseFilterBackend):
+    """
+    ``?category_tree=<slug>`` keeps the products of that category and all of
+    its descendants with one prefix match on the indexed ``path``.
+    """
+    tree_param = 'category_tree'
+
+    def filter_queryset(self, request, queryset, view):
+        slug = request.query_params.get(self.tree_param)
+        if not slug:
+            return queryset
+        node = category_tree().get(slug)
+        if node is None:
+            return queryset.none()
+        return queryset.filter(category__path__startswith=node['path'])
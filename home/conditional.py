@@ -0,0 +1,78 @@
+"""
+HTTP conditional requests (ETag/Last-Modified) for catalogue reads.
+
+The validators of a response come from the version counters of
+``home.cache``: every change to what a catalogue list or detail shows bumps
+the version of the namespace the request belongs to, and records when it
+did. A matching ``If-None-Match`` is therefore answered with 304 Not
+Modified after one cache read, before the database, the page cache or the
+serializers are touched.
+
+A bump moves the validators of every request in its namespace, including
+pages the change did not reach; those clients get a full response once.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .cache import ALL, request_namespace, version_state
+
+
+def validators(request, namespace):
+    """
+    Weak ETag and Last-Modified timestamp of a response for ``request``
+    rendered from the catalogue ``namespace``.
+    """
+    version, changed = version_state(namespace)
+    raw = '|'.join([request.accepted_renderer.format,
+                    request.get_full_path(), namespace, str(version)])
+    etag = 'W/' + quote_etag(hashlib.md5(raw.encode('utf-8')).hexdigest())
+    return etag, changed
+
+
+def not_modified(request, etag, last_modified):
+    """
+    304 (or 412) response when the client's copy is current, else ``None``.
+    """
+    return get_conditional_response(request, etag=etag,
+                                    last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+
+
+def conditional_namespace(view, request):
+    # Only a viewset that filters on the category has pages that depend on
+    # that category alone.
+    if 'category' in getattr(view, 'filterset_fields', ()):
+        return request_namespace(request)
+    return ALL
+
+
+def conditional(view_method):
+    """
+    ETag/Last-Modified support for catalogue viewset ``list``/``retrieve``
+    handlers.
+
+    A request whose validators still match gets 304 Not Modified without
+    running the handler; only successful responses carry validators, so
+    details of missing rows are left to the handler's 404. Apply it outside
+    ``catalogue_cached`` so conditional hits skip the page cache too.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        etag, last_modified = validators(
+            request, conditional_namespace(self, request))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
+    return wrapper
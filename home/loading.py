@@ -0,0 +1,108 @@
+from functools import lru_cache
+
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+from .rows import ValuesSerializer
+
+
+class LoadingPlan:
+    """
+    ``select_related``/``prefetch_related``/``only`` arguments that let a
+    serializer render a queryset without per-row queries.
+    """
+
+    def __init__(self):
+        self.select_related = []
+        self.prefetch_related = []
+        self.only = []
+        # False when a serializer reads attributes that are not model
+        # fields (properties, methods), so columns cannot be restricted.
+        self.exact = True
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.exact and self.only:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+
+def _collect(serializer, prefix, plan, nested_in_prefetch=False):
+    model = serializer.Meta.model
+    concrete = {field.name for field in model._meta.concrete_fields}
+    concrete.add('pk')
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or '.' in field.source:
+            plan.exact = False
+            continue
+        path = f'{prefix}{field.source}'
+        if isinstance(field, serializers.ListSerializer):
+            plan.prefetch_related.append(path)
+            _collect(field.child, f'{path}__', plan, nested_in_prefetch=True)
+        elif isinstance(field, serializers.ManyRelatedField):
+            plan.prefetch_related.append(path)
+        elif isinstance(field, serializers.ModelSerializer):
+            if nested_in_prefetch:
+                plan.prefetch_related.append(path)
+            else:
+                plan.select_related.append(path)
+                plan.only.append(path)
+            _collect(field, f'{path}__', plan, nested_in_prefetch)
+        elif field.source in concrete:
+            if not nested_in_prefetch:
+                plan.only.append(path)
+        elif not nested_in_prefetch:
+            plan.exact = False
+
+
+@lru_cache(maxsize=None)
+def loading_plan(serializer_class):
+    """
+    Derive the loading plan from the fields ``serializer_class`` renders:
+    nested serializers are joined (or prefetched under a many relation),
+    many-related fields are prefetched, and only rendered columns are
+    loaded. Plain primary-key relations need nothing, as DRF reads the
+    ``*_id`` attribute.
+    """
+    plan = LoadingPlan()
+    if issubclass(serializer_class, serializers.ModelSerializer):
+        _collect(serializer_class(), '', plan)
+    return plan
+
+
+def eager_load(queryset, serializer_class):
+    if issubclass(serializer_class, ValuesSerializer):
+        return serializer_class.load(queryset)
+    return loading_plan(serializer_class).apply(queryset)
+
+
+class EagerLoadingMixin:
+    """
+    Viewset mixin loading read querysets with the plan of the viewset's
+    serializer. Viewsets that build their own queryset pass it through
+    ``eager_load``.
+
+    ``read_serializer_classes`` maps actions to ``ValuesSerializer``s used
+    for their reads instead of ``serializer_class``; the queryset then
+    yields ``.values()`` rows.
+    """
+    read_serializer_classes = {}
+
+    def get_serializer_class(self):
+        if (self.request.method in SAFE_METHODS
+                and self.action in self.read_serializer_classes):
+            return self.read_serializer_classes[self.action]
+        return super().get_serializer_class()
+
+    def eager_load(self, queryset):
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        return eager_load(queryset, self.get_serializer_class())
+
+    def get_queryset(self):
+        return self.eager_load(super().get_queryset())
@@ -0,0 +1,397 @@
+"""
+Load test of the REST API: concurrent virtual users drive a running server
+over HTTP, run with ``python manage.py loadtest``.
+
+Unlike ``home.benchmarks`` the dataset is committed, as the server under
+test has to see it; ``seed`` replaces it and ``clear`` removes it. Query
+counts come from the ``X-Query-Count`` header, so they are only reported
+when the server runs with ``DEBUG`` on. A handful of virtual users make all
+the requests, so a server not started here (``start_server``) has to run
+with ``THROTTLE_OFF=1`` or the rate limits answer most of them with 429.
+"""
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .benchmarks import NOUNS, seed_catalogue, summarize
+from .categories import rebuild_paths
+from .models import Cart, Category, Coupon, Order, ProductVariant
+from .search import refresh_search_vectors
+
+USER_PREFIX = 'loadtest-user'
+PASSWORD = 'loadtest-password'
+COUPON_CODE = 'LOADTEST'
+# seed_catalogue() names the categories bench-category-<seed>-<n>.
+CATALOGUE_SEED = 7
+CATEGORY_PREFIX = f'bench-category-{CATALOGUE_SEED}-'
+
+
+def clear():
+    User.objects.filter(username__startswith=f'{USER_PREFIX}-').delete()
+    Category.objects.filter(slug__startswith=CATEGORY_PREFIX).delete()
+    Coupon.objects.filter(code=COUPON_CODE).delete()
+
+
+def seed(users=50, products=2000, categories=20, orders_per_user=2):
+    """
+    Replace the load-test dataset: a two-level category tree, products with
+    four variants each, users with a cart and a few past orders, and a
+    coupon.
+    """
+    clear()
+    categories = seed_catalogue(products=products, categories=categories,
+                                variants_per_product=4, seed=CATALOGUE_SEED)
+    roots = categories[:max(1, len(categories) // 4)]
+    children = categories[len(roots):]
+    for i, category in enumerate(children):
+        category.parent = roots[i % len(roots)]
+    Category.objects.bulk_update(children, ['parent'])
+    rebuild_paths()
+    refresh_search_vectors()
+
+    # Order creation is superuser-only (IsSuperUserOrReadOnly on
+    # OrderViewSet), so the virtual users need the flag to check out.
+    password = make_password(PASSWORD)
+    accounts = User.objects.bulk_create([
+        User(username=f'{USER_PREFIX}-{i}', password=password,
+             is_staff=True, is_superuser=True)
+        for i in range(users)
+    ])
+    Cart.objects.bulk_create([Cart(user=user) for user in accounts])
+    Order.objects.bulk_create([
+        Order(user=user, subtotal=Decimal('20.00'),
+              grand_total=Decimal('20.00'), item_count=2)
+        for user in accounts
+        for _ in range(orders_per_user)
+    ])
+    Coupon.objects.create(
+        code=COUPON_CODE, discount_amount=Decimal('5.00'),
+        expiration_date=timezone.now().date() + timedelta(days=365),
+    )
+
+
+def catalogue():
+    """
+    Ids the virtual users pick from, read once before the run.
+    """
+    variants = list(
+        ProductVariant.objects
+        .filter(product__category__slug__startswith=CATEGORY_PREFIX)
+        .values_list('pk', 'product_id', 'price')
+    )
+    return {
+        'users': list(
+            User.objects.filter(username__startswith=f'{USER_PREFIX}-')
+            .order_by('pk').values_list('username', flat=True)
+        ),
+        'categories': list(
+            Category.objects.filter(slug__startswith=CATEGORY_PREFIX)
+            .values_list('pk', flat=True)
+        ),
+        'roots': list(
+            Category.objects.filter(slug__startswith=CATEGORY_PREFIX,
+                                    parent__isnull=True)
+            .values_list('slug', flat=True)
+        ),
+        'products': sorted({product for _, product, _ in variants}),
+        'variants': [(pk, str(price)) for pk, _, price in variants],
+    }
+
+
+class Stats:
+    """
+    Latencies, query counts and failures per endpoint, shared by the
+    virtual-user threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.failures = Counter()
+
+    def record(self, name, elapsed, ok, queries=None):
+        with self._lock:
+            self.samples[name].append(elapsed)
+            if queries is not None:
+                self.queries[name].append(queries)
+            if not ok:
+                self.failures[name] += 1
+
+    def results(self, elapsed):
+        results = {}
+        everything = []
+        for name, samples in sorted(self.samples.items()):
+            # Logins happen once per user, not at a steady rate.
+            if name != 'login':
+                everything += samples
+            queries = self.queries.get(name)
+            results[name] = dict(
+                summarize(samples),
+                requests=len(samples),
+                rps=len(samples) / elapsed,
+                failure_rate=self.failures[name] / len(samples),
+                queries=max(queries) if queries else None,
+            )
+        if everything:
+            results['total'] = dict(
+                summarize(everything),
+                requests=len(everything),
+                rps=len(everything) / elapsed,
+                failure_rate=(sum(self.failures.values())
+                              - self.failures['login']) / len(everything),
+                queries=None,
+            )
+        return results
+
+
+class VirtualUser:
+    """
+    One shopper: logs in with a JWT, then runs weighted tasks until the
+    deadline. Statuses a task can legitimately get under contention (out of
+    stock, a concurrently changed cart) are not counted as failures.
+    """
+    tasks = (
+        ('browse', 10),
+        ('browse_tree', 4),
+        ('search', 6),
+        ('view_product', 8),
+        ('add_to_cart', 4),
+        ('update_cart', 2),
+        ('view_cart', 2),
+        ('apply_coupon', 1),
+        ('checkout', 1),
+    )
+
+    def __init__(self, base_url, username, catalogue, stats, seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.catalogue = catalogue
+        self.stats = stats
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.cart = {}
+
+    def request(self, name, method, path, expected=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, f'{self.base_url}{path}', timeout=30, **kwargs)
+        except requests.RequestException:
+            self.stats.record(name, time.perf_counter() - start, False)
+            return None
+        queries = response.headers.get('X-Query-Count')
+        self.stats.record(
+            name, time.perf_counter() - start,
+            response.status_code in expected,
+            int(queries) if queries is not None else None,
+        )
+        return response
+
+    def login(self):
+        response = self.request('login', 'post', '/api/login/', json={
+            'username': self.username, 'password': PASSWORD,
+        })
+        if response is not None and response.ok:
+            token = response.json()['access']
+            self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def browse(self):
+        category = self.rng.choice(self.catalogue['categories'])
+        self.request('product list', 'get',
+                     f'/api/products/?category={category}')
+
+    def search(self):
+        term = self.rng.choice(NOUNS)[:self.rng.randint(3, 6)]
+        self.request('product search', 'get',
+                     f'/api/products/search/?q={term}')
+
+    def browse_tree(self):
+        root = self.rng.choice(self.catalogue['roots'])
+        self.request('category tree', 'get',
+                     f'/api/products/?category_tree={root}')
+
+    def view_product(self):
+        product = self.rng.choice(self.catalogue['products'])
+        self.request('product detail', 'get', f'/api/products/{product}/')
+
+    def add_to_cart(self):
+        variant, price = self.rng.choice(self.catalogue['variants'])
+        response = self.request(
+            'cart add', 'post', '/api/cart/add/', expected=(200, 400),
+            json={'product_variant': variant, 'quantity': 1,
+                  'price_at_time': price},
+        )
+        if response is not None and response.status_code == 200:
+            self.cart[variant] = price
+
+    def update_cart(self):
+        if not self.cart:
+            return self.add_to_cart()
+        variant = self.rng.choice(list(self.cart))
+        self.request(
+            'cart update', 'put', '/api/cart/update/',
+            expected=(200, 204, 400, 404, 409),
+            json={'product_variant': variant,
+                  'quantity': self.rng.randint(1, 3),
+                  'price_at_time': self.cart[variant]},
+        )
+
+    def view_cart(self):
+        self.request('cart', 'get', '/api/cart/')
+
+    def apply_coupon(self):
+        self.request('coupon apply', 'post', '/api/coupons/apply/',
+                     json={'code': COUPON_CODE})
+
+    def checkout(self):
+        response = self.request('order create', 'post', '/api/orders/create/',
+                                expected=(200, 400, 409))
+        if response is not None and response.status_code == 200:
+            self.cart.clear()
+
+    def run(self, deadline, iterations=None):
+        """
+        Run tasks until ``deadline``, or ``iterations`` of them when given;
+        every task makes one request.
+        """
+        self.login()
+        names, weights = zip(*self.tasks)
+        done = 0
+        while (done < iterations if iterations is not None
+               else time.monotonic() < deadline):
+            getattr(self, self.rng.choices(names, weights)[0])()
+            done += 1
+
+
+def run(base_url, users=10, duration=30.0, seed=0, iterations=None):
+    """
+    Run ``users`` concurrent virtual users for ``duration`` seconds, or for
+    ``iterations`` tasks each, and return the per-endpoint results.
+    """
+    shop = catalogue()
+    if not shop['users']:
+        raise ValueError("No load-test users; seed the dataset first.")
+    stats = Stats()
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=VirtualUser(
+            base_url, shop['users'][i % len(shop['users'])], shop, stats,
+            seed=seed + i,
+        ).run, args=(deadline, iterations))
+        for i in range(users)
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.results(time.monotonic() - start)
+
+
+def hammer(base_url, paths, connections=50, duration=10.0):
+    """
+    Keep ``connections`` keep-alive connections busy with ``GET``s of
+    ``paths`` (round-robin) for ``duration`` seconds, and return the
+    latency and throughput summary of all requests.
+    """
+    base_url = base_url.rstrip('/')
+    stats = Stats()
+    deadline = time.monotonic() + duration
+
+    def connection(offset):
+        session = requests.Session()
+        n = offset
+        while time.monotonic() < deadline:
+            path = paths[n % len(paths)]
+            n += 1
+            start = time.perf_counter()
+            try:
+                ok = session.get(f'{base_url}{path}', timeout=30).ok
+            except requests.RequestException:
+                ok = False
+            stats.record('get', time.perf_counter() - start, ok)
+
+    threads = [threading.Thread(target=connection, args=(i,))
+               for i in range(connections)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.results(time.monotonic() - start)['get']
+
+
+def start_server(command, url, attempts=100):
+    """
+    Start ``command`` from the project directory, with rate limiting off,
+    and wait until ``url`` answers; return the process.
+    """
+    server = subprocess.Popen(command, cwd=settings.BASE_DIR,
+                              env={**os.environ, 'THROTTLE_OFF': '1'},
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    for _ in range(attempts):
+        try:
+            requests.get(url, timeout=10)
+            return server
+        except requests.RequestException:
+            if server.poll() is not None:
+                break
+            time.sleep(0.1)
+    server.terminate()
+    server.wait()
+    raise RuntimeError(f"Server did not start: {' '.join(command)}")
+
+
+def stop_server(server):
+    server.terminate()
+    server.wait()
+
+
+def compare(results, baseline, tolerance=0.25, slack_ms=5.0):
+    """
+    Regressions of ``results`` against a saved ``baseline``, as messages.
+
+    Latency percentiles may grow by ``tolerance`` plus ``slack_ms`` (so
+    millisecond endpoints do not fail on noise), query counts may not grow
+    at all, and total throughput may drop by ``tolerance``.
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            regressions.append(f"{name}: not exercised")
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            limit = base[key] * (1 + tolerance) + slack_ms
+            if current[key] > limit:
+                regressions.append(
+                    f"{name}: {key} {current[key]:.1f} > {limit:.1f}")
+        if (base['queries'] is not None and current['queries'] is not None
+                and current['queries'] > base['queries']):
+            regressions.append(
+                f"{name}: {current['queries']} queries "
+                f"(baseline {base['queries']})")
+        if current['failure_rate'] > base['failure_rate'] + 0.01:
+            regressions.append(
+                f"{name}: failure rate {current['failure_rate']:.1%} "
+                f"(baseline {base['failure_rate']:.1%})")
+    total = baseline.get('total')
+    if total and 'total' in results:
+        floor = total['rps'] * (1 - tolerance)
+        if results['total']['rps'] < floor:
+            regressions.append(
+                f"total: {results['total']['rps']:.1f} req/s < {floor:.1f}")
+    return regressions
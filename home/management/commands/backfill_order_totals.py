@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from home.models import Order
+from home.orders import recalculate_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized totals of every order in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        updated = 0
+        while True:
+            # Walk the primary key instead of using OFFSET so every batch is
+            # an index range scan, and commit per batch to keep locks short.
+            order_ids = list(
+                Order.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                break
+            with transaction.atomic():
+                updated += recalculate_totals(order_ids)
+            last_pk = order_ids[-1]
+            self.stdout.write(f"Updated {updated} orders...")
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled totals for {updated} orders."))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from home.benchmarks import BENCHMARKS
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Run a benchmark from home.benchmarks. Seeded data is rolled "
+            "back unless --keep is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?',
+                            help="Benchmark to run; omit to list them.")
+        parser.add_argument('--size', type=int,
+                            help="Number of rows to seed.")
+        parser.add_argument('--repeat', type=int,
+                            help="Number of timed iterations.")
+        parser.add_argument('--keep', action='store_true',
+                            help="Commit the seeded data.")
+
+    def handle(self, *args, **options):
+        name = options['name']
+        if name is None:
+            for name, func in sorted(BENCHMARKS.items()):
+                summary = (func.__doc__ or '').strip().splitlines() or ['']
+                self.stdout.write(f"{name:<16} {summary[0]}")
+            return
+        if name not in BENCHMARKS:
+            raise CommandError(f"Unknown benchmark '{name}'.")
+
+        kwargs = {key: options[key] for key in ('size', 'repeat')
+                  if options[key] is not None}
+        try:
+            with transaction.atomic():
+                BENCHMARKS[name](self.stdout, **kwargs)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            pass
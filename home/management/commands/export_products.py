@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from home import product_io
+
+
+class Command(BaseCommand):
+    help = ("Stream the catalogue as CSV or NDJSON that import_products "
+            "reads back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=product_io.FORMATS,
+                            default='csv')
+        parser.add_argument('--output',
+                            help="File to write to instead of stdout.")
+        parser.add_argument('--batch-size', type=int,
+                            default=product_io.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        chunks = product_io.export_products(options['format'],
+                                            batch_size=options['batch_size'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='',
+                  encoding='utf-8') as f:
+            f.writelines(chunks)
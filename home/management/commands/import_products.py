@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home import product_io
+
+
+class Command(BaseCommand):
+    help = ("Stream products, variants and tags from a CSV or NDJSON file "
+            "into the catalogue in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--format', choices=product_io.FORMATS,
+                            help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int,
+                            default=product_io.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            format = product_io.file_format(path, options['format'])
+            if path == '-':
+                result = product_io.import_products(
+                    sys.stdin, format, options['batch_size'])
+            else:
+                with open(path, newline='', encoding='utf-8-sig') as f:
+                    result = product_io.import_products(
+                        f, format, options['batch_size'])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        for error in result['errors']:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['products']} products, {result['variants']} "
+            f"variants and {result['tags']} new tags; skipped "
+            f"{result['skipped']}."))
@@ -0,0 +1,104 @@
+import json
+import sys
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from home import loadtest
+
+
+class Command(BaseCommand):
+    help = ("Drive the REST API of a running server with concurrent virtual "
+            "users and report latency percentiles, throughput and query "
+            "counts per endpoint.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help="Base URL of the server under test, run "
+                                 "with THROTTLE_OFF=1.")
+        parser.add_argument('--serve', action='store_true',
+                            help="Start runserver on --url for the run.")
+        parser.add_argument('--users', type=int, default=10,
+                            help="Number of concurrent virtual users.")
+        parser.add_argument('--duration', type=float, default=30,
+                            help="Length of the run in seconds.")
+        parser.add_argument('--iterations', type=int,
+                            help="Run this many requests per virtual user "
+                                 "instead of --duration seconds.")
+        parser.add_argument('--seed', action='store_true',
+                            help="(Re)create the load-test dataset first.")
+        parser.add_argument('--allow-seed', action='store_true',
+                            help="Allow --seed with DEBUG off.")
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--clear', action='store_true',
+                            help="Delete the load-test dataset and exit.")
+        parser.add_argument('--output',
+                            help="Write the results to this JSON file, "
+                                 "e.g. to save a baseline.")
+        parser.add_argument('--baseline',
+                            help="Fail if the results regress against this "
+                                 "JSON file.")
+        parser.add_argument('--tolerance', type=float, default=0.25)
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            loadtest.clear()
+            self.stdout.write(self.style.SUCCESS("Load-test data deleted."))
+            return
+        if options['seed']:
+            # The seeded superusers share a known password: keep them out of
+            # anything but a development database unless asked for.
+            if not (settings.DEBUG or options['allow_seed']):
+                raise CommandError(
+                    "Refusing to seed with DEBUG off; pass --allow-seed if "
+                    "this database is meant for load tests.")
+            loadtest.seed(users=options['users'],
+                          products=options['products'],
+                          categories=options['categories'])
+            self.stdout.write("Seeded load-test data.")
+
+        server = None
+        try:
+            if options['serve']:
+                server = loadtest.start_server(
+                    [sys.executable, 'manage.py', 'runserver', '--noreload',
+                     urlsplit(options['url']).netloc], options['url'])
+            results = loadtest.run(options['url'], users=options['users'],
+                                   duration=options['duration'],
+                                   iterations=options['iterations'])
+        except (RuntimeError, ValueError) as exc:
+            raise CommandError(str(exc))
+        finally:
+            if server is not None:
+                loadtest.stop_server(server)
+        self.report(results)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'users': options['users'],
+                           'duration': options['duration'],
+                           'endpoints': results}, f, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['endpoints']
+            regressions = loadtest.compare(results, baseline,
+                                           tolerance=options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n  "
+                                   + "\n  ".join(regressions))
+            self.stdout.write(self.style.SUCCESS(
+                "No regressions against the baseline."))
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'endpoint':<16} {'reqs':>6} {'req/s':>7} {'p50':>8} "
+            f"{'p95':>8} {'p99':>8} {'fail':>6} {'queries':>7}")
+        for name, row in results.items():
+            queries = '-' if row['queries'] is None else row['queries']
+            self.stdout.write(
+                f"{name:<16} {row['requests']:>6} {row['rps']:>7.1f} "
+                f"{row['p50_ms']:>6.1f}ms {row['p95_ms']:>6.1f}ms "
+                f"{row['p99_ms']:>6.1f}ms {row['failure_rate']:>6.1%} "
+                f"{queries:>7}")
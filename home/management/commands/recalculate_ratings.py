@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from home.models import Product
+from home.ratings import recalculate_ratings
+
+
+class Command(BaseCommand):
+    help = ("Recompute the review aggregates of every product in batches "
+            "and repair the ones that drifted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        checked = corrected = 0
+        while True:
+            # Walk the primary key like backfill_order_totals, one short
+            # transaction per batch.
+            product_ids = list(
+                Product.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not product_ids:
+                break
+            with transaction.atomic():
+                corrected += recalculate_ratings(product_ids)
+            checked += len(product_ids)
+            last_pk = product_ids[-1]
+            self.stdout.write(f"Checked {checked} products...")
+        self.stdout.write(self.style.SUCCESS(
+            f"Corrected the ratings of {corrected} of {checked} products."))
@@ -0,0 +1,70 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home import loadtest
+
+
+class Command(BaseCommand):
+    help = ("Compare the throughput of the catalogue reads under WSGI "
+            "(gunicorn, core.wsgi) and ASGI (uvicorn, core.asgi) with many "
+            "concurrent connections. Needs the load-test dataset "
+            "(loadtest --seed).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help="Worker processes per server.")
+        parser.add_argument('--threads', type=int, default=4,
+                            help="Threads per gunicorn worker.")
+        parser.add_argument('--connections', type=int, default=50,
+                            help="Concurrent client connections.")
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8101)
+
+    def handle(self, *args, **options):
+        shop = loadtest.catalogue()
+        if not shop['products']:
+            raise CommandError(
+                "No load-test data; run loadtest --seed first.")
+        product = shop['products'][len(shop['products']) // 2]
+        variant = shop['variants'][0][0]
+        paths = ['/products/', f'/products/{product}/', '/category/',
+                 f'/product-variants/{variant}/']
+        paths += [f'/products/?category_tree={root}'
+                  for root in shop['roots'][:2]]
+        address = f"{options['host']}:{options['port']}"
+        url = f"http://{address}"
+        workers = str(options['workers'])
+        servers = {
+            'WSGI': [sys.executable, '-m', 'gunicorn', 'core.wsgi:application',
+                     '--bind', address, '--workers', workers,
+                     '--threads', str(options['threads'])],
+            'ASGI': [sys.executable, '-m', 'uvicorn', 'core.asgi:application',
+                     '--host', options['host'], '--port',
+                     str(options['port']), '--workers', workers,
+                     '--no-access-log'],
+        }
+        runs = (
+            ('WSGI', 'sync views', '/api'),
+            ('ASGI', 'sync views', '/api'),
+            ('ASGI', 'async views', '/api/async'),
+        )
+        for name, label, prefix in runs:
+            try:
+                server = loadtest.start_server(servers[name],
+                                               f'{url}/api/category/')
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+            try:
+                row = loadtest.hammer(
+                    url, [f'{prefix}{path}' for path in paths],
+                    connections=options['connections'],
+                    duration=options['duration'])
+            finally:
+                loadtest.stop_server(server)
+            self.stdout.write(
+                f"{name} {label:<12} {row['rps']:8.1f} req/s "
+                f"p50={row['p50_ms']:7.1f}ms p95={row['p95_ms']:7.1f}ms "
+                f"p99={row['p99_ms']:7.1f}ms "
+                f"failures={row['failure_rate']:.1%}")
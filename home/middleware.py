@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    """
+    ``connection.execute_wrapper`` hook recording every SQL statement and its
+    duration. Statements are fingerprinted by their parametrised SQL, so the
+    same query run for each row of a page shows up as a duplicate.
+    """
+
+    def __init__(self):
+        self.fingerprints = Counter()
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(n - 1 for n in self.fingerprints.values() if n > 1)
+
+    def most_repeated(self):
+        if not self.fingerprints:
+            return None
+        sql, count = self.fingerprints.most_common(1)[0]
+        return (sql, count) if count > 1 else None
+
+
+class QueryMetrics:
+    """
+    Per-route query statistics aggregated in-process since startup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, recorder, over_budget):
+        with self._lock:
+            stats = self._routes.setdefault(route, {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'sql_time_ms': 0.0, 'duplicates': 0, 'over_budget': 0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += recorder.count
+            stats['max_queries'] = max(stats['max_queries'], recorder.count)
+            stats['sql_time_ms'] += recorder.duration * 1000
+            stats['duplicates'] += recorder.duplicates
+            stats['over_budget'] += over_budget
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                route: dict(stats,
+                            avg_queries=stats['queries'] / stats['requests'])
+                for route, stats in self._routes.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+query_metrics = QueryMetrics()
+
+
+UNMATCHED = 'unmatched'
+
+
+class RecordedStream:
+    """
+    Streaming content that keeps ``recorder`` on the connection while each
+    chunk is produced, and calls ``done`` once it is exhausted or closed;
+    the queries of a streamed response run after the view has returned.
+    """
+
+    def __init__(self, content, recorder, done):
+        self.content = iter(content)
+        self.recorder = recorder
+        self.done = done
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            # Chunks may be produced on another thread than the view ran
+            # on (ASGI), so the wrapper goes on for each one.
+            with connection.execute_wrapper(self.recorder):
+                return next(self.content)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.done()
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is not None and match.view_name:
+        return match.view_name
+    # One entry for every 404 path, or any client could grow the metrics
+    # without bound.
+    return UNMATCHED
+
+
+class QueryCountMiddleware:
+    """
+    Count the queries, total SQL time and duplicate queries of each request.
+
+    With ``DEBUG`` on they are returned as ``X-Query-*`` response headers;
+    they are always aggregated per route in ``query_metrics``. Routes named
+    in ``settings.QUERY_BUDGETS`` log a warning when they exceed their
+    budget. Streamed responses (with sync content) are counted until their
+    content is exhausted or closed, and carry no headers as their count is
+    not known when the headers are sent. Async-capable, so it does not push
+    async views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        return self.finish(request, response, recorder)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        # The async ORM runs queries on the request's thread-sensitive
+        # executor, so the wrapper has to go on that thread's connection.
+        wrapping = await sync_to_async(self.wrap)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrapping.__exit__)(None, None, None)
+        return self.finish(request, response, recorder)
+
+    @staticmethod
+    def wrap(recorder):
+        wrapping = connection.execute_wrapper(recorder)
+        wrapping.__enter__()
+        return wrapping
+
+    def finish(self, request, response, recorder):
+        if response.streaming and not response.is_async:
+            response.streaming_content = RecordedStream(
+                response.streaming_content, recorder,
+                lambda: self.record(request, recorder))
+            return response
+        budget = self.record(request, recorder)
+        if settings.DEBUG:
+            response['X-Query-Count'] = recorder.count
+            response['X-Query-Time-Ms'] = f'{recorder.duration * 1000:.2f}'
+            response['X-Query-Duplicates'] = recorder.duplicates
+            if budget is not None:
+                response['X-Query-Budget'] = budget
+        return response
+
+    def record(self, request, recorder):
+        """
+        Aggregate the request's queries for its route and return the
+        route's budget.
+        """
+        route = route_name(request)
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(route)
+        over_budget = budget is not None and recorder.count > budget
+        query_metrics.record(route, recorder, over_budget)
+        if over_budget:
+            logger.warning(
+                "%s ran %d queries (budget %d); most repeated: %s",
+                route, recorder.count, budget, recorder.most_repeated(),
+            )
+        return budget
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.8 on 2026-10-18 05:24
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Category = apps.get_model('home', 'Category')
+    categories = {category.pk: category for category in Category.objects.all()}
+    paths = {}
+
+    def path_of(category):
+        if category.pk not in paths:
+            parent = categories.get(category.parent_id)
+            prefix = path_of(parent) if parent else ''
+            paths[category.pk] = f'{prefix}{category.pk}/'
+        return paths[category.pk]
+
+    for category in categories.values():
+        category.path = path_of(category)
+    Category.objects.bulk_update(categories.values(), ['path'],
+                                 batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0002_index_plan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.8 on 2026-10-18 06:39
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def hold_existing_lines(apps, schema_editor):
+    # Lines added so far took their stock when they were added; start
+    # their holds now.
+    CartItem = apps.get_model('home', 'CartItem')
+    CartItem.objects.update(reserved_until=timezone.now() + datetime.timedelta(
+        seconds=settings.CART_HOLD_TIMEOUT))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0005_order_confirmation_sent_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(condition=models.Q(('reserved_until__isnull', False)), fields=['reserved_until'], name='cart_item_hold_expiry_idx'),
+        ),
+        migrations.RunPython(hold_existing_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.1.8 on 2026-10-18 06:59
+
+from collections import Counter, defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rate_existing_products(apps, schema_editor):
+    # Same aggregates as home.ratings.recalculate_ratings, for every
+    # product reviewed so far.
+    Product = apps.get_model('home', 'Product')
+    Review = apps.get_model('home', 'Review')
+    histograms = defaultdict(Counter)
+    for row in (Review.objects.values('product_id', 'rating')
+                .annotate(reviews=Count('pk')).order_by()):
+        histograms[row['product_id']][row['rating']] = row['reviews']
+    products = []
+    for product_id, counts in histograms.items():
+        count = sum(counts.values())
+        total = sum(rating * n for rating, n in counts.items())
+        products.append(Product(
+            pk=product_id, rating_count=count, rating_sum=total,
+            rating_average=(Decimal(total) / count).quantize(
+                Decimal('0.01'), rounding=ROUND_HALF_UP),
+            **{f'rating_{rating}': counts[rating] for rating in range(1, 6)}))
+    Product.objects.bulk_update(
+        products, ['rating_count', 'rating_sum', 'rating_average',
+                   *[f'rating_{rating}' for rating in range(1, 6)]],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0006_cart_item_holds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_average',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating_average', 'id'], name='product_rating_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating_count', 'id'], name='product_rating_count_id_idx'),
+        ),
+        migrations.RunPython(rate_existing_products,
+                             migrations.RunPython.noop),
+    ]
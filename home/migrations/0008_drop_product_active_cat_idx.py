@@ -0,0 +1,17 @@
+# Generated by Django 5.1.8 on 2026-10-18 08:09
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0007_product_ratings'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_active_cat_idx',
+        ),
+    ]
@@ -1,8 +1,17 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+from django.db.models.functions import Concat, Substr
 from django.utils.text import slugify
 from django.contrib.auth.models import User  # Import the default User model
 
 
+MAX_RATING = 5
+# Product fields the search data is built from (home.search).
+SEARCH_FIELDS = ('name', 'description')
+
+
 class OrderStatus(models.TextChoices):
     Pending = 'Pending'
     Shipped = 'Shipped'
@@ -39,6 +48,12 @@ class Profile(models.Model):
         return f"Profile of {self.user.username}"
 
 
+class CategoryCycle(ValueError):
+    """
+    A category was given a parent inside its own subtree.
+    """
+
+
 class Category(models.Model):
     """
     Category model to store categories for products.
@@ -49,11 +64,52 @@ class Category(models.Model):
                                null=True, blank=True,
                                related_name='subcategories')
     description = models.TextField(blank=True)
+    # Materialized path of primary keys from the root, e.g. "1/5/12/", so a
+    # subtree is one indexed prefix match; see home.categories.
+    path = models.CharField(max_length=255, default='', editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['path'], name='category_path_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
+
+    def in_subtree(self, pk, path):
+        """
+        Whether the category ``pk`` at ``path`` is this one or below it. Goes
+        by this category's segment of ``path``, so it holds for rows whose
+        own path is not filled in yet.
+        """
+        return pk == self.pk or f'/{self.pk}/' in f'/{path}'
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            old_path = ''
+            if self.pk:
+                old_path = Category.objects.filter(pk=self.pk).values_list(
+                    'path', flat=True).first() or ''
+            parent_path = ''
+            if self.parent_id:
+                parent_path = Category.objects.values_list(
+                    'path', flat=True).get(pk=self.parent_id)
+            if self.pk and self.in_subtree(self.parent_id, parent_path):
+                raise CategoryCycle(
+                    "A category cannot be moved below itself.")
+            super().save(*args, **kwargs)
+            self.path = f'{parent_path}{self.pk}/'
+            if self.path != old_path:
+                Category.objects.filter(pk=self.pk).update(path=self.path)
+            if old_path and self.path != old_path:
+                # Re-root the descendants in a single UPDATE.
+                Category.objects.filter(path__startswith=old_path).exclude(
+                    pk=self.pk).update(path=Concat(
+                        models.Value(self.path),
+                        Substr('path', len(old_path) + 1),
+                        output_field=models.CharField(),
+                    ))
 
     def __str__(self):
         return self.name
@@ -65,8 +121,9 @@ class Product(models.Model):
     """
     name = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True)
+    # Indexed by the (category, created_at, id) index in Meta.
     category = models.ForeignKey(Category, on_delete=models.CASCADE,
-                                 related_name='products')
+                                 related_name='products', db_index=False)
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_price = models.DecimalField(max_digits=10, decimal_places=2,
@@ -76,11 +133,78 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Weighted name/description tsvector kept up to date by home.search.
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Review aggregates kept up to date by home.ratings; rating_<n> counts
+    # the reviews rating n (up to MAX_RATING).
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.DecimalField(max_digits=3, decimal_places=2,
+                                         default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'],
+                     name='product_search_vector_gin'),
+            # Keyset pagination: default listing, ?ordering=price and
+            # ?category= listings all seek on (key, id).
+            models.Index(fields=['-created_at', '-id'],
+                         name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'],
+                         name='product_price_id_idx'),
+            models.Index(fields=['category', '-created_at', '-id'],
+                         name='product_cat_created_idx'),
+            models.Index(fields=['name'], name='product_name_idx'),
+            # ?ordering=(-)rating_average / rating_count listings.
+            models.Index(fields=['rating_average', 'id'],
+                         name='product_rating_id_idx'),
+            models.Index(fields=['rating_count', 'id'],
+                         name='product_rating_count_id_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the row held, so save() can tell what it changes without
+        # reading the row again.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def changed_fields(self, update_fields=None):
+        """
+        Attnames of the loaded fields a save with ``update_fields`` writes
+        with values other than those read from the database; every field
+        of a new product.
+        """
+        loaded = getattr(self, '_loaded_values', {})
+        deferred = self.get_deferred_fields()
+        return {
+            field.attname for field in self._meta.concrete_fields
+            if field.attname not in deferred
+            and (update_fields is None
+                 or field.name in update_fields
+                 or field.attname in update_fields)
+            and loaded.get(field.attname, models.DEFERRED)
+            != getattr(self, field.attname)
+        }
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        changed = self.changed_fields(kwargs.get('update_fields'))
+        loaded = getattr(self, '_loaded_values', {})
+        # Read by the post_save receivers in home.signals.
+        self._search_changed = not changed.isdisjoint(SEARCH_FIELDS)
+        self._previous_category_id = (loaded.get('category_id')
+                                      if 'category_id' in changed else None)
         super().save(*args, **kwargs)
+        self._loaded_values = {
+            **loaded, **{name: getattr(self, name) for name in changed}}
 
     def __str__(self):
         return self.name
@@ -93,6 +217,7 @@ class ProductVariant(models.Model):
     varient_value = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{
@@ -107,18 +232,41 @@ class Cart(models.Model):
     coupon = models.ForeignKey("Coupon", null=True, blank=True,
                                on_delete=models.SET_NULL)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user'],
+                                    name='unique_cart_per_user'),
+        ]
+
     def __str__(self):
         return f"Cart for {self.user.username}"
 
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE,
-                             related_name='items')
+                             related_name='items', db_index=False)
     product_variant = models.ForeignKey(ProductVariant,
                                         on_delete=models.CASCADE,
                                         related_name='cart_items')
     quantity = models.PositiveIntegerField(default=1)
     price_at_time = models.DecimalField(max_digits=10, decimal_places=2)
+    # The line's quantity is taken from stock until then; NULL once the
+    # hold expired and home.stock.release_expired_holds gave it back.
+    reserved_until = models.DateTimeField(null=True, blank=True,
+                                          editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product_variant'],
+                                    name='unique_cart_line'),
+        ]
+        indexes = [
+            # The expiry sweeper reads the oldest holds first and never
+            # looks at released lines.
+            models.Index(fields=['reserved_until'],
+                         condition=models.Q(reserved_until__isnull=False),
+                         name='cart_item_hold_expiry_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product_variant.product.name} - {self.quantity}"
@@ -126,7 +274,7 @@ class CartItem(models.Model):
 
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
-                             related_name='orders')
+                             related_name='orders', db_index=False)
     order_status = models.CharField(
         max_length=20,
         choices=OrderStatus.choices,
@@ -137,8 +285,33 @@ class Order(models.Model):
         choices=PaymentStatus.choices,
         default=PaymentStatus.Unpaid
     )
+    # Totals are denormalized so order lists and payments never aggregate
+    # OrderItem rows at read time; see home.orders.recalculate_totals.
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2,
+                                   default=0)
+    discount_total = models.DecimalField(max_digits=12, decimal_places=2,
+                                         default=0)
+    grand_total = models.DecimalField(max_digits=12, decimal_places=2,
+                                      default=0)
+    item_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set by home.tasks.send_order_confirmation, so retries never send the
+    # confirmation twice.
+    confirmation_sent_at = models.DateTimeField(null=True, blank=True,
+                                                editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'],
+                         name='order_created_id_idx'),
+            models.Index(fields=['user', '-created_at'],
+                         name='order_user_created_idx'),
+            models.Index(fields=['user', 'order_status'],
+                         name='order_user_status_idx'),
+            models.Index(fields=['order_status', '-created_at'],
+                         name='order_status_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
@@ -153,7 +326,7 @@ class OrderItem(models.Model):
     price_at_time = models.DecimalField(max_digits=10, decimal_places=2)
 
     def __str__(self):
-        return f"{self.product_variant.name} - {self.quantity}"
+        return f"{self.product_variant.product.name} - {self.quantity}"
 
 
 class Payment(models.Model):
@@ -191,24 +364,37 @@ class ShippingAddress(models.Model):
 
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE,
-                                related_name='reviews')
+                                related_name='reviews', db_index=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='reviews')
-    rating = models.PositiveIntegerField()
+    rating = models.PositiveIntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(MAX_RATING)])
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'user'],
+                                    name='unique_review_per_user'),
+        ]
+
     def __str__(self):
         return f"Review for {self.product.name} by {self.user.username}"
 
 
 class Wishlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
-                             related_name='wishlists')
+                             related_name='wishlists', db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE,
                                 related_name='wishlists')
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'],
+                                    name='unique_wishlist_item'),
+        ]
+
     def __str__(self):
         return f"Wishlist for {self.user.username} - {self.product.name}"
 
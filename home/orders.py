@@ -0,0 +1,110 @@
+from decimal import Decimal
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Cart, CartItem, Order, OrderItem
+from .pricing import coupon_discount, priced
+from .stock import NotEnoughStock, adjust_stock
+from .tasks import process_order
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class CartChanged(Exception):
+    """
+    The cart was modified (e.g. checked out by another request) while the
+    order was being placed or its lines were being changed in bulk.
+    """
+
+
+def place_order(user):
+    """
+    Turn the user's cart into an order in one transaction.
+
+    The pipeline issues a fixed number of queries whatever the cart size:
+    one locking read of the priced cart lines (with the cart's coupon), one
+    insert for the order with its totals computed up front, one bulk insert
+    of the order items, one delete that empties the cart and one update
+    that clears the cart's coupon. Lines are charged at their current price
+    (see ``home.pricing``). Lines whose stock hold expired take their stock
+    again, with one more update, or fail with ``NotEnoughStock``.
+
+    Payment, low-stock and confirmation processing is queued as Celery tasks
+    once the transaction commits (``home.tasks.process_order``), so the
+    caller gets the order back without waiting for it.
+    """
+    with transaction.atomic():
+        # Locked, so the hold sweeper cannot release them meanwhile.
+        items = list(
+            priced(CartItem.objects.filter(cart__user=user))
+            .select_related('cart__coupon')
+            .select_for_update(of=('self',))
+        )
+        if not items:
+            raise EmptyCart
+        released = {item.product_variant_id: item.quantity
+                    for item in items if item.reserved_until is None}
+        if released and not adjust_stock(released):
+            raise NotEnoughStock(sorted(released))
+        subtotal = sum(item.line_total for item in items)
+        coupon = items[0].cart.coupon
+        discount = coupon_discount(coupon, subtotal)
+        order = Order.objects.create(
+            user=user,
+            subtotal=subtotal,
+            discount_total=discount,
+            grand_total=subtotal - discount,
+            item_count=sum(item.quantity for item in items),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_variant_id=item.product_variant_id,
+                quantity=item.quantity,
+                price_at_time=item.unit_price,
+            )
+            for item in items
+        ])
+        deleted, _ = CartItem.objects.filter(
+            pk__in=[item.pk for item in items]).delete()
+        if deleted != len(items):
+            # Someone else already checked these lines out; roll back
+            # rather than creating a second order for them.
+            raise CartChanged
+        # Also moves updated_at, so the cached cart summary is dropped.
+        Cart.objects.filter(user=user).update(coupon=None,
+                                              updated_at=timezone.now())
+        # robust: the order stands even if the broker cannot be reached.
+        transaction.on_commit(partial(process_order, order.pk), robust=True)
+    return order
+
+
+def recalculate_totals(order_ids):
+    """
+    Recompute the denormalized totals of the given orders from their items
+    with one grouped aggregate and one bulk update. The discount already
+    recorded on each order is kept.
+    """
+    sums = {
+        row['order_id']: row
+        for row in OrderItem.objects.filter(order_id__in=order_ids)
+        .values('order_id')
+        .annotate(subtotal=Sum(F('price_at_time') * F('quantity')),
+                  item_count=Sum('quantity'))
+    }
+    orders = list(Order.objects.filter(pk__in=order_ids).only(
+        'id', 'subtotal', 'discount_total', 'grand_total', 'item_count'))
+    for order in orders:
+        row = sums.get(order.pk, {})
+        order.subtotal = row.get('subtotal') or Decimal('0')
+        order.item_count = row.get('item_count') or 0
+        order.discount_total = min(order.discount_total, order.subtotal)
+        order.grand_total = order.subtotal - order.discount_total
+    Order.objects.bulk_update(orders, ['subtotal', 'discount_total',
+                                       'grand_total', 'item_count'])
+    return len(orders)
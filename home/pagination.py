@@ -0,0 +1,181 @@
+import json
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def keyset_filter(ordering, values):
+    """
+    Condition selecting the rows after ``values`` in ``ordering``.
+
+    ``(a, b) > (x, y)`` is spelled ``a > x OR (a = x AND b > y)`` so mixed
+    ascending/descending keys work column by column, plus a redundant
+    ``a >= x`` that the database can use as an index range bound.
+    """
+    condition = Q()
+    equal = {}
+    for key, value in zip(ordering, values):
+        name = key.lstrip('-')
+        lookup = 'lt' if key.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    first = ordering[0].lstrip('-')
+    bound = 'lte' if ordering[0].startswith('-') else 'gte'
+    return Q(**{f'{first}__{bound}': values[0]}) & condition
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over the queryset ordering plus the primary key.
+
+    Instead of ``OFFSET n`` every page is fetched with a ``WHERE`` clause on
+    the ordering columns of the last row already seen, so page 500 costs the
+    same as page one. The ordering comes from the queryset (which is where
+    ``OrderingFilter`` puts it) and falls back to ``ordering``; ``id`` is
+    always appended as a tie breaker. Ordering columns must be non-null.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_rows(
+            list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        return self.paginate_rows(
+            [row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """
+        The unevaluated query for the requested page, plus one row to tell
+        whether there is another page.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.keys = self.get_ordering(queryset)
+        self.model = queryset.model
+        self.fields = [
+            queryset.model._meta.get_field(key.lstrip('-'))
+            for key in self.keys
+        ]
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor['reverse']
+        ordering = [self._flip(key) if reverse else key for key in self.keys]
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(
+                keyset_filter(ordering, self.cursor['values']))
+        return queryset[:self.page_size + 1]
+
+    def paginate_rows(self, results):
+        cursor = self.cursor
+        reverse = cursor is not None and cursor['reverse']
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        # Moving backwards, "more" rows lie before the page; the rows after
+        # it are the ones we came from.
+        self.has_next = has_more if not reverse else cursor is not None
+        self.has_previous = cursor is not None if not reverse else has_more
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True,
+                         'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True,
+                             'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by) or list(self.ordering)
+        ordering = [
+            key.replace('pk', 'id', 1) if key.lstrip('-') == 'pk' else key
+            for key in ordering
+        ]
+        if not any(key.lstrip('-') == 'id' for key in ordering):
+            descending = ordering[0].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse):
+        if isinstance(instance, dict):
+            # A .values() row (see home.rows).
+            instance = self.model(**{field.attname: instance[field.name]
+                                     for field in self.fields})
+        values = [
+            field.value_to_string(instance) for field in self.fields
+        ]
+        payload = json.dumps({'v': values, 'r': reverse},
+                             separators=(',', ':'))
+        encoded = b64encode(payload.encode('utf-8')).decode('ascii')
+        url = remove_query_param(self.base_url, self.page_size_query_param)
+        if self.page_size != type(self).page_size:
+            url = replace_query_param(url, self.page_size_query_param,
+                                      self.page_size)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(b64decode(parse.unquote(encoded)))
+            values = [
+                field.to_python(value)
+                for field, value in zip(self.fields, payload['v'],
+                                        strict=True)
+            ]
+            reverse = bool(payload['r'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': reverse}
+
+    @staticmethod
+    def _flip(key):
+        return key[1:] if key.startswith('-') else f'-{key}'
@@ -0,0 +1,134 @@
+"""
+Server-side cart pricing.
+
+A line costs its product's ``discount_price`` when one is set, otherwise
+its variant's price; the cart's coupon then comes off the subtotal. The
+cart summary and checkout both price lines here, so what the summary shows
+is what the order charges.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.db.models import DecimalField, ExpressionWrapper, F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import cache
+from .models import Cart, Coupon
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def coupon_discount(coupon, subtotal):
+    """
+    Discount a coupon grants on ``subtotal``; never more than the subtotal.
+    """
+    if (coupon is None or not coupon.is_active
+            or coupon.expiration_date < timezone.now().date()):
+        return Decimal('0')
+    return min(coupon.discount_amount, subtotal)
+
+
+def priced(items):
+    """
+    Annotate a ``CartItem`` queryset with ``unit_price`` and ``line_total``.
+    """
+    return items.annotate(
+        unit_price=Coalesce('product_variant__product__discount_price',
+                            'product_variant__price', output_field=MONEY),
+        line_total=ExpressionWrapper(F('unit_price') * F('quantity'),
+                                     output_field=MONEY),
+    )
+
+
+def unit_price(variant):
+    """
+    Current price of ``variant``; its product should be loaded already.
+    """
+    discount_price = variant.product.discount_price
+    return variant.price if discount_price is None else discount_price
+
+
+def touch_cart(cart_id):
+    """
+    Move ``Cart.updated_at`` forward after its lines changed through
+    queryset updates, which invalidates the cached summary.
+    """
+    Cart.objects.filter(pk=cart_id).update(updated_at=timezone.now())
+
+
+def cart_summary(cart):
+    """
+    Lines, subtotal, coupon discount and grand total of ``cart``, computed
+    with one query whatever the number of lines.
+    """
+    lines = list(
+        priced(cart.items.all()).order_by('pk').values(
+            'id', 'quantity', 'unit_price', 'line_total',
+            'product_variant_id',
+            'product_variant__price',
+            'product_variant__varient_name',
+            'product_variant__varient_value',
+            'product_variant__product_id',
+            'product_variant__product__name',
+            'cart__coupon__code',
+            'cart__coupon__discount_amount',
+            'cart__coupon__is_active',
+            'cart__coupon__expiration_date',
+        )
+    )
+    subtotal = sum((line['line_total'] for line in lines), Decimal('0'))
+    coupon = None
+    if lines and lines[0]['cart__coupon__code'] is not None:
+        coupon = Coupon(
+            code=lines[0]['cart__coupon__code'],
+            discount_amount=lines[0]['cart__coupon__discount_amount'],
+            is_active=lines[0]['cart__coupon__is_active'],
+            expiration_date=lines[0]['cart__coupon__expiration_date'],
+        )
+    discount = coupon_discount(coupon, subtotal)
+    return {
+        'cart': cart.pk,
+        'lines': [
+            {
+                'id': line['id'],
+                'product': line['product_variant__product_id'],
+                'product_variant': line['product_variant_id'],
+                'name': line['product_variant__product__name'],
+                'variant': (f"{line['product_variant__varient_name']}: "
+                            f"{line['product_variant__varient_value']}"),
+                'quantity': line['quantity'],
+                'list_price': line['product_variant__price'],
+                'unit_price': line['unit_price'],
+                'line_total': line['line_total'],
+            }
+            for line in lines
+        ],
+        'item_count': sum(line['quantity'] for line in lines),
+        'subtotal': subtotal,
+        'coupon': coupon.code if coupon is not None else None,
+        'discount': discount,
+        'grand_total': subtotal - discount,
+    }
+
+
+def summary_key(cart):
+    # Product price changes bump the catalogue version, cart changes move
+    # updated_at; either way the old entry is never read again.
+    catalogue = cache.get_version(cache.ALL)
+    return (f'cart:summary:{cart.pk}:{cart.updated_at.timestamp()}:'
+            f'{catalogue}')
+
+
+def cached_cart_summary(cart, render):
+    """
+    ``render(cart_summary(cart))``, cached until the cart or the catalogue
+    changes.
+    """
+    key = summary_key(cart)
+    data = django_cache.get(key)
+    if data is None:
+        data = render(cart_summary(cart))
+        django_cache.set(key, data, timeout=settings.CART_SUMMARY_TIMEOUT)
+    return data
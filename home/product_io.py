@@ -0,0 +1,460 @@
+"""
+Streaming product import and export, in CSV or NDJSON.
+
+NDJSON has one product per line::
+
+    {"name": "Blue shirt", "slug": "blue-shirt", "category": "clothing",
+     "description": "", "price": "19.99", "discount_price": null,
+     "inventory_count": 10, "is_active": true, "tags": ["cotton"],
+     "variants": [{"name": "Size", "value": "M", "price": "19.99",
+                   "stock_count": 4}]}
+
+CSV has one row per variant under the ``CSV_FIELDS`` header, the product
+columns repeated on each row; consecutive rows with the same slug (or name,
+when there is no slug) are one product. Tags are separated by ``|``.
+
+Categories are referenced by slug and must exist. A product whose slug is
+already taken is skipped, so re-running an import is harmless; products
+without a slug get a unique one derived from their name. A slug taken by a
+concurrent writer while its batch is written is skipped the same way.
+
+Imports read, validate and write ``batch_size`` products at a time, each
+batch in its own transaction, and exports read the catalogue in primary key
+batches, so memory stays flat whatever the size of the file.
+"""
+import csv
+import json
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+
+from . import cache
+from .models import Category, Product, ProductVariant, Tag
+from .search import refresh_search_vectors
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+CSV_FIELDS = ['name', 'slug', 'category', 'description', 'price',
+              'discount_price', 'inventory_count', 'is_active', 'tags',
+              'variant_name', 'variant_value', 'variant_price',
+              'stock_count']
+EXPORTED_FIELDS = ['name', 'slug', 'category', 'description', 'price',
+                   'discount_price', 'inventory_count', 'is_active']
+BATCH_SIZE = 1000
+# Only the first skipped rows are described in the result.
+MAX_ERRORS = 100
+
+
+class RowError(ValueError):
+    pass
+
+
+def file_format(filename, requested=None):
+    """
+    ``requested`` if given, otherwise the format implied by ``filename``.
+    """
+    if requested is None:
+        extension = filename.rsplit('.', 1)[-1].lower()
+        requested = {'jsonl': 'ndjson'}.get(extension, extension)
+    if requested not in FORMATS:
+        raise ValueError(
+            f"Unknown format {requested!r}; use one of {', '.join(FORMATS)}.")
+    return requested
+
+
+def read_ndjson(lines):
+    """
+    Yield ``(line number, product)`` for each line; a line that is not a
+    JSON object yields a ``RowError`` instead of a product.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            record = RowError(f"invalid JSON: {exc}")
+        if not isinstance(record, (dict, RowError)):
+            record = RowError("expected a JSON object")
+        yield number, record
+
+
+def read_csv(lines):
+    """
+    Yield ``(line number, product)`` for each group of variant rows.
+    """
+    reader = csv.DictReader(lines)
+    missing = {'name', 'price'} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(
+            f"CSV is missing the {', '.join(sorted(missing))} column(s).")
+    product = key = number = None
+    for row in reader:
+        row = {field: (value or '').strip() for field, value in row.items()
+               if field}
+        row_key = row.get('slug') or row.get('name')
+        if product is None or row_key != key:
+            if product is not None:
+                yield number, product
+            product = {field: row.get(field) for field in EXPORTED_FIELDS}
+            product['tags'] = row.get('tags', '').split('|')
+            product['variants'] = []
+            key, number = row_key, reader.line_num
+        if row.get('variant_name') or row.get('variant_value'):
+            product['variants'].append({
+                'name': row.get('variant_name'),
+                'value': row.get('variant_value'),
+                'price': row.get('variant_price'),
+                'stock_count': row.get('stock_count'),
+            })
+    if product is not None:
+        yield number, product
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def text(value, field, max_length=None, required=False):
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f"{field} is required")
+    if max_length is not None and len(value) > max_length:
+        raise RowError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def decimal(value, field, required=False):
+    if value is None or value == '':
+        if required:
+            raise RowError(f"{field} is required")
+        return None
+    try:
+        value = Decimal(str(value))
+    except InvalidOperation:
+        raise RowError(f"{field} is not a number")
+    if not value.is_finite() or value < 0 or value >= 10 ** 8:
+        raise RowError(f"{field} is out of range")
+    return value.quantize(Decimal('0.01'))
+
+
+def count(value, field):
+    if value is None or value == '':
+        return 0
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{field} is not a whole number")
+    if value < 0:
+        raise RowError(f"{field} is negative")
+    return value
+
+
+def boolean(value, field):
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    raise RowError(f"{field} is not true or false")
+
+
+def clean(record):
+    """
+    Validate one product read from a file, raising ``RowError``.
+    """
+    if isinstance(record, RowError):
+        raise record
+    price = decimal(record.get('price'), 'price', required=True)
+    tags = record.get('tags') or []
+    variants = record.get('variants') or []
+    if not isinstance(tags, list) or not isinstance(variants, list):
+        raise RowError("tags and variants must be lists")
+    if not all(isinstance(variant, dict) for variant in variants):
+        raise RowError("variants must be objects")
+    return {
+        'name': text(record.get('name'), 'name', 255, required=True),
+        'slug': slugify(text(record.get('slug'), 'slug', 255)),
+        'category': text(record.get('category'), 'category',
+                         required=True),
+        'description': text(record.get('description'), 'description'),
+        'price': price,
+        'discount_price': decimal(record.get('discount_price'),
+                                  'discount_price'),
+        'inventory_count': count(record.get('inventory_count'),
+                                 'inventory_count'),
+        'is_active': boolean(record.get('is_active'), 'is_active'),
+        'tags': {text(tag, 'tag', 100) for tag in tags} - {''},
+        'variants': [clean_variant(variant, price) for variant in variants],
+    }
+
+
+def clean_variant(variant, product_price):
+    price = decimal(variant.get('price'), 'variant price')
+    return {
+        'varient_name': text(variant.get('name'), 'variant name', 255,
+                             required=True),
+        'varient_value': text(variant.get('value'), 'variant value', 255,
+                              required=True),
+        'price': product_price if price is None else price,
+        'stock_count': count(variant.get('stock_count'), 'stock_count'),
+    }
+
+
+def unique_slugs(model, names, reserved=()):
+    """
+    A slug for each of ``names`` that is unused in ``model``'s table, in
+    ``reserved`` and among the others: ``slugify(name)``, else ``name-2``,
+    ``name-3``...
+
+    Each round checks a window of candidates for every unresolved name with
+    one ``slug IN (...)`` query; the window doubles every round, so even
+    many products sharing a name resolve in a few queries.
+    """
+    max_length = model._meta.get_field('slug').max_length
+    bases = [slugify(name)[:max_length - 8] or model._meta.model_name
+             for name in names]
+    slugs = [None] * len(names)
+    taken = set(reserved)
+    start = {i: 1 for i in range(len(names))}
+    window = 1
+    while start:
+        candidates = {
+            i: [base if n == 1 else f'{base}-{n}'
+                for n in range(start[i], start[i] + window)]
+            for i, base in ((i, bases[i]) for i in start)
+        }
+        taken.update(model.objects.filter(slug__in=[
+            slug for group in candidates.values() for slug in group
+        ]).values_list('slug', flat=True))
+        for i, group in candidates.items():
+            free = next((slug for slug in group if slug not in taken), None)
+            if free is None:
+                start[i] += window
+                continue
+            slugs[i] = free
+            taken.add(free)
+            del start[i]
+        window *= 2
+    return slugs
+
+
+def resolve_tags(names):
+    """
+    Map tag names to primary keys, creating the missing tags, with one
+    lookup and one insert.
+    """
+    found = dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+    missing = sorted(set(names) - set(found))
+    created = Tag.objects.bulk_create([
+        Tag(name=name, slug=slug)
+        for name, slug in zip(missing, unique_slugs(Tag, missing))
+    ])
+    found.update((tag.name, tag.pk) for tag in created)
+    return found, len(created)
+
+
+def skip(result, number, reason):
+    result['skipped'] += 1
+    if len(result['errors']) < MAX_ERRORS:
+        result['errors'].append(f"line {number}: {reason}")
+
+
+def import_batch(batch, result):
+    rows = []
+    for number, record in batch:
+        try:
+            rows.append((number, clean(record)))
+        except RowError as exc:
+            skip(result, number, exc)
+
+    categories = dict(Category.objects.filter(
+        slug__in={row['category'] for _, row in rows}
+    ).values_list('slug', 'pk'))
+    taken = set(Product.objects.filter(
+        slug__in=[row['slug'] for _, row in rows if row['slug']]
+    ).values_list('slug', flat=True))
+    keep = []
+    for number, row in rows:
+        if row['category'] not in categories:
+            skip(result, number, f"unknown category {row['category']!r}")
+        elif row['slug'] and row['slug'] in taken:
+            skip(result, number, f"slug {row['slug']!r} already exists")
+        else:
+            if row['slug']:
+                taken.add(row['slug'])
+            keep.append((number, row))
+    if not keep:
+        return
+
+    unnamed = [row for _, row in keep if not row['slug']]
+    for row, slug in zip(unnamed, unique_slugs(
+            Product, [row['name'] for row in unnamed], reserved=taken)):
+        row['slug'] = slug
+
+    try:
+        created = write_batch([row for _, row in keep], categories)
+    except IntegrityError:
+        # Another writer took some of the slugs (or tag names) since they
+        # were checked, and the batch was rolled back. Skip the products
+        # whose slugs are gone and write the rest once more.
+        taken = set(Product.objects.filter(
+            slug__in=[row['slug'] for _, row in keep]
+        ).values_list('slug', flat=True))
+        retry = []
+        for number, row in keep:
+            if row['slug'] in taken:
+                skip(result, number, f"slug {row['slug']!r} already exists")
+            else:
+                retry.append((number, row))
+        try:
+            created = write_batch([row for _, row in retry], categories)
+        except IntegrityError as exc:
+            for number, _ in retry:
+                skip(result, number, f"not imported: {exc}")
+            return
+    products, variants, new_tags = created
+    # bulk_create sends no signals; drop the affected cached listings once
+    # the products are committed.
+    transaction.on_commit(partial(
+        cache.bump_category, *{product.category_id for product in products}))
+    result['products'] += len(products)
+    result['variants'] += len(variants)
+    result['tags'] += new_tags
+
+
+def write_batch(rows, categories):
+    """
+    Insert cleaned products with their variants and tags in one
+    transaction; returns the products, the variants and the number of new
+    tags.
+    """
+    if not rows:
+        return [], [], 0
+    with transaction.atomic():
+        tags, new_tags = resolve_tags(
+            {tag for row in rows for tag in row['tags']})
+        products = Product.objects.bulk_create([
+            Product(category_id=categories[row['category']],
+                    **{field: row[field] for field in EXPORTED_FIELDS
+                       if field != 'category'})
+            for row in rows
+        ])
+        variants = ProductVariant.objects.bulk_create([
+            ProductVariant(product=product, **variant)
+            for product, row in zip(products, rows)
+            for variant in row['variants']
+        ])
+        Product.tags.through.objects.bulk_create([
+            Product.tags.through(product_id=product.pk, tag_id=tags[tag])
+            for product, row in zip(products, rows)
+            for tag in row['tags']
+        ])
+        refresh_search_vectors(
+            Product.objects.filter(pk__in=[p.pk for p in products]))
+    return products, variants, new_tags
+
+
+def import_products(lines, format, batch_size=BATCH_SIZE):
+    """
+    Import products from an iterable of text lines in ``format``. Returns
+    the number of products, variants and new tags created, the number of
+    skipped products and why the first ``MAX_ERRORS`` were skipped.
+    """
+    records = READERS[file_format('', format)](lines)
+    result = {'products': 0, 'variants': 0, 'tags': 0, 'skipped': 0,
+              'errors': []}
+    while batch := list(islice(records, batch_size)):
+        import_batch(batch, result)
+    return result
+
+
+class Echo:
+    """
+    File-like object handing back what is written, for ``csv.writer``.
+    """
+
+    def write(self, value):
+        return value
+
+
+def product_batches(queryset, batch_size):
+    """
+    Yield the products of ``queryset`` in primary key order as dicts with
+    their ``variants`` and ``tags``, loading ``batch_size`` products (three
+    queries) at a time. Plain rows skip building model instances.
+    """
+    fields = [field for field in EXPORTED_FIELDS if field != 'category']
+    queryset = queryset.order_by('pk').values('pk', 'category__slug', *fields)
+    last_pk = 0
+    while products := list(queryset.filter(pk__gt=last_pk)[:batch_size]):
+        ids = [product['pk'] for product in products]
+        variants = defaultdict(list)
+        for row in ProductVariant.objects.filter(
+                product_id__in=ids).order_by('pk').values_list(
+                'product_id', 'varient_name', 'varient_value', 'price',
+                'stock_count'):
+            variants[row[0]].append(row[1:])
+        tags = defaultdict(list)
+        for product_id, name in Product.tags.through.objects.filter(
+                product_id__in=ids).values_list('product_id', 'tag__name'):
+            tags[product_id].append(name)
+        for product in products:
+            product['variants'] = variants[product['pk']]
+            product['tags'] = sorted(tags[product['pk']])
+            yield product
+        last_pk = ids[-1]
+
+
+def export_products(format, queryset=None, batch_size=BATCH_SIZE):
+    """
+    Yield the products of ``queryset`` (all by default) as chunks of CSV or
+    NDJSON text that ``import_products`` reads back.
+    """
+    format = file_format('', format)
+    if queryset is None:
+        queryset = Product.objects.all()
+    products = product_batches(queryset, batch_size)
+    if format == 'ndjson':
+        for product in products:
+            discount_price = product['discount_price']
+            yield json.dumps({
+                'name': product['name'],
+                'slug': product['slug'],
+                'category': product['category__slug'],
+                'description': product['description'] or '',
+                'price': str(product['price']),
+                'discount_price': (None if discount_price is None
+                                   else str(discount_price)),
+                'inventory_count': product['inventory_count'],
+                'is_active': product['is_active'],
+                'tags': product['tags'],
+                'variants': [
+                    {'name': name, 'value': value, 'price': str(price),
+                     'stock_count': stock_count}
+                    for name, value, price, stock_count
+                    in product['variants']
+                ],
+            }) + '\n'
+        return
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_FIELDS)
+    for product in products:
+        discount_price = product['discount_price']
+        columns = [
+            product['name'], product['slug'], product['category__slug'],
+            product['description'] or '', product['price'],
+            '' if discount_price is None else discount_price,
+            product['inventory_count'], str(product['is_active']).lower(),
+            '|'.join(product['tags']),
+        ]
+        yield ''.join(writer.writerow(columns + list(variant))
+                      for variant in product['variants'] or [('',) * 4])
@@ -0,0 +1,120 @@
+"""
+Review aggregates stored on ``Product``.
+
+Listings show and sort by a product's rating without touching its reviews:
+``rating_count``, ``rating_sum``, ``rating_average`` and the per-rating
+counts ``rating_1`` to ``rating_5`` are moved by every review saved or
+deleted (see ``home.signals``) with one ``UPDATE`` of relative changes, so
+concurrent reviews of a product never overwrite each other's counts. Bulk
+writes that bypass signals leave them behind until ``recalculate_ratings``
+(the ``recalculate_ratings`` command) recomputes them from the reviews.
+"""
+from collections import Counter, defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.utils import timezone
+
+from .models import MAX_RATING, Product, Review
+
+HISTOGRAM_FIELDS = [f'rating_{rating}' for rating in range(1, MAX_RATING + 1)]
+RATING_FIELDS = ['rating_count', 'rating_sum', 'rating_average',
+                 *HISTOGRAM_FIELDS]
+
+
+class DecimalCast(Cast):
+    """
+    ``Cast`` to a decimal that also divides as one on SQLite, where a
+    decimal cast of an integer stays an integer.
+    """
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection,
+                           template='(%(expressions)s * 1.0)', **extra_context)
+
+
+def change_ratings(product_id, deltas):
+    """
+    Add ``deltas[rating]`` reviews (negative to remove them) to the
+    aggregates of a product.
+    """
+    deltas = Counter({rating: delta for rating, delta in deltas.items()
+                      if delta})
+    if not deltas:
+        return
+    count = F('rating_count') + sum(deltas.values())
+    total = F('rating_sum') + sum(rating * delta
+                                  for rating, delta in deltas.items())
+    # The right-hand sides all see the row as it was before the UPDATE.
+    average = Coalesce(
+        DecimalCast(total, DecimalField(max_digits=12, decimal_places=2))
+        / NullIf(count, Value(0)),
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=3, decimal_places=2))
+    histogram = {f'rating_{rating}': F(f'rating_{rating}') + delta
+                 for rating, delta in deltas.items()}
+    Product.objects.filter(pk=product_id).update(
+        rating_count=count, rating_sum=total, rating_average=average,
+        **histogram, updated_at=timezone.now())
+
+
+def move_rating(previous=None, current=None):
+    """
+    Account for a review going from ``previous`` to ``current``, each a
+    ``(product_id, rating)`` pair or ``None`` for no review.
+    """
+    deltas = defaultdict(Counter)
+    if previous is not None:
+        deltas[previous[0]][previous[1]] -= 1
+    if current is not None:
+        deltas[current[0]][current[1]] += 1
+    for product_id, changes in deltas.items():
+        change_ratings(product_id, changes)
+
+
+def rating_average(total, count):
+    if not count:
+        return Decimal('0.00')
+    # Rounded like the database rounds into numeric(3, 2).
+    return (Decimal(total) / count).quantize(Decimal('0.01'),
+                                             rounding=ROUND_HALF_UP)
+
+
+def recalculate_ratings(product_ids):
+    """
+    Recompute the aggregates of the given products from their reviews with
+    one grouped aggregate and one bulk update of the products that drifted.
+    Returns the number of products corrected. Must run in a transaction.
+    """
+    # Locked before the reviews are read: a review saved meanwhile waits
+    # to apply its change on top of the recomputed aggregates.
+    products = list(Product.objects.select_for_update().filter(
+        pk__in=product_ids).only('id', *RATING_FIELDS))
+    histograms = {
+        f'rating_{rating}': Count('pk', filter=Q(rating=rating))
+        for rating in range(1, MAX_RATING + 1)
+    }
+    rows = {
+        row['product_id']: row
+        for row in Review.objects.filter(product_id__in=product_ids)
+        .values('product_id').annotate(count=Count('pk'), total=Sum('rating'),
+                                       **histograms).order_by()
+    }
+
+    drifted = []
+    now = timezone.now()
+    for product in products:
+        row = rows.get(product.pk, {})
+        stored = [getattr(product, name) for name in RATING_FIELDS]
+        product.rating_count = row.get('count', 0)
+        product.rating_sum = row.get('total') or 0
+        product.rating_average = rating_average(product.rating_sum,
+                                                product.rating_count)
+        for name in HISTOGRAM_FIELDS:
+            setattr(product, name, row.get(name, 0))
+        if stored != [getattr(product, name) for name in RATING_FIELDS]:
+            product.updated_at = now
+            drifted.append(product)
+    Product.objects.bulk_update(drifted, RATING_FIELDS + ['updated_at'])
+    return len(drifted)
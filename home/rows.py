@@ -0,0 +1,167 @@
+"""
+Read-path serializers rendering ``.values()`` rows.
+
+A ``ValuesSerializer`` produces exactly what its ``model_serializer`` would
+for a read, but from plain rows: the model serializer's fields are
+inspected once per class and compiled into a list of columns, so rendering
+a row is a dict lookup per field (plus the field's own conversion for
+decimals and dates) instead of model instances and per-row field binding.
+Reverse foreign keys and many-to-many fields of the model serializer are
+loaded with one query each per page, like a prefetch.
+"""
+from collections import defaultdict
+from functools import lru_cache
+
+from rest_framework import serializers
+
+# Fields whose representation of a database value is the value itself.
+PLAIN_FIELDS = (serializers.BooleanField, serializers.CharField,
+                serializers.IntegerField)
+
+
+class CompiledFields:
+    def __init__(self, model_serializer):
+        serializer = model_serializer()
+        self.model = model_serializer.Meta.model
+        self.pk = self.model._meta.pk.attname
+        # (name, values() path, conversion or None) in output order; the
+        # path is None for children, which are filled in from the children
+        # fetched for the page.
+        self.fields = []
+        # name -> (query for the children of some parents, parent key,
+        # compiled fields of a child or None for primary keys)
+        self.children = {}
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                relation = self.model._meta.get_field(field.source)
+                child = compiled(type(field.child))
+                if child.children:
+                    raise TypeError(
+                        f"{model_serializer.__name__}.{name} nests "
+                        f"children two levels deep.")
+                key = relation.field.attname
+                self.children[name] = (
+                    relation.related_model.objects.order_by(child.pk)
+                    .values(key, *child.paths), key, child)
+                self.fields.append((name, None, None))
+            elif isinstance(field, serializers.ManyRelatedField):
+                relation = self.model._meta.get_field(field.source)
+                through = relation.remote_field.through
+                key = f'{relation.m2m_field_name()}_id'
+                self.children[name] = (
+                    through.objects.order_by('pk').values_list(
+                        key, f'{relation.m2m_reverse_field_name()}_id'),
+                    key, None)
+                self.fields.append((name, None, None))
+            elif (field.source == '*' or '.' in field.source
+                  or (isinstance(field, (serializers.Serializer,
+                                         serializers.RelatedField))
+                      and not isinstance(
+                          field, serializers.PrimaryKeyRelatedField))):
+                raise TypeError(
+                    f"{model_serializer.__name__}.{name} cannot be read "
+                    f"from .values() rows.")
+            else:
+                # values() gives foreign keys as their primary key, which
+                # is what PrimaryKeyRelatedField renders.
+                plain = isinstance(field, (*PLAIN_FIELDS,
+                                           serializers.RelatedField))
+                self.fields.append(
+                    (name, field.source, None if plain
+                     else field.to_representation))
+        self.paths = [self.pk] + [path for name, path, convert in self.fields
+                                  if path not in (None, self.pk)]
+
+    def child_queries(self, rows):
+        ids = [row[self.pk] for row in rows]
+        for name, (query, key, child) in self.children.items():
+            yield name, query.filter(**{f'{key}__in': ids}), key, child
+
+    def group(self, children):
+        """
+        ``{name: {parent pk: [rendered children]}}`` from fetched children.
+        """
+        grouped = {}
+        for name, (key, child, fetched) in children.items():
+            by_parent = defaultdict(list)
+            if child is None:
+                for parent, pk in fetched:
+                    by_parent[parent].append(pk)
+            else:
+                for row, data in zip(fetched, child.render(fetched, {})):
+                    by_parent[row[key]].append(data)
+            grouped[name] = by_parent
+        return grouped
+
+    def fetch(self, rows):
+        return self.group({
+            name: (key, child, list(query))
+            for name, query, key, child in self.child_queries(rows)
+        })
+
+    async def afetch(self, rows):
+        children = {}
+        for name, query, key, child in self.child_queries(rows):
+            children[name] = (key, child, [row async for row in query])
+        return self.group(children)
+
+    def render(self, rows, grouped):
+        data = []
+        for row in rows:
+            item = {}
+            for name, path, convert in self.fields:
+                if path is None:
+                    item[name] = grouped[name][row[self.pk]]
+                    continue
+                value = row[path]
+                item[name] = (value if convert is None or value is None
+                              else convert(value))
+            data.append(item)
+        return data
+
+
+@lru_cache(maxsize=None)
+def compiled(model_serializer):
+    return CompiledFields(model_serializer)
+
+
+class ValuesSerializer:
+    """
+    Read-only stand-in for ``model_serializer`` taking rows loaded by
+    ``load(queryset)`` instead of model instances.
+    """
+    model_serializer = None
+
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    def load(cls, queryset):
+        return queryset.values(*compiled(cls.model_serializer).paths)
+
+    def rows(self):
+        return list(self.instance) if self.many else [self.instance]
+
+    def result(self, data):
+        return data if self.many else data[0]
+
+    @property
+    def data(self):
+        fields = compiled(self.model_serializer)
+        rows = self.rows()
+        return self.result(fields.render(rows, fields.fetch(rows)))
+
+    async def adata(self):
+        """
+        ``data`` for async views, fetching the children with the async ORM.
+        """
+        fields = compiled(self.model_serializer)
+        rows = self.rows()
+        return self.result(fields.render(rows, await fields.afetch(rows)))
+
+    def to_representation(self, row):
+        fields = compiled(self.model_serializer)
+        return fields.render([row], fields.fetch([row]))[0]
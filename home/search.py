@@ -0,0 +1,250 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Product
+
+TOKEN_RE = re.compile(r'\w+')
+# Name matches outrank description matches in both backends.
+NAME_WEIGHT = 'A'
+DESCRIPTION_WEIGHT = 'B'
+MAX_RESULTS = 100
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def search_config():
+    return getattr(settings, 'PRODUCT_SEARCH_CONFIG', 'english')
+
+
+def product_vector():
+    config = search_config()
+    return (
+        SearchVector('name', weight=NAME_WEIGHT, config=config)
+        + SearchVector('description', weight=DESCRIPTION_WEIGHT,
+                       config=config)
+    )
+
+
+class PostgresSearchBackend:
+    """
+    Ranked prefix search over the precomputed ``Product.search_vector``
+    column, answered from its GIN index.
+    """
+
+    def refresh(self, queryset):
+        queryset.update(search_vector=product_vector())
+
+    def forget(self, product_ids):
+        # The vectors went with the rows.
+        pass
+
+    def build_query(self, text):
+        # Every term is matched as a prefix: "blu sh" finds "blue shirt".
+        return SearchQuery(' & '.join(f'{term}:*' for term in tokenize(text)),
+                           search_type='raw', config=search_config())
+
+    def filter(self, queryset, text):
+        return queryset.filter(search_vector=self.build_query(text))
+
+    def search(self, queryset, text, limit):
+        query = self.build_query(text)
+        return list(
+            queryset.filter(search_vector=query)
+            .annotate(rank=SearchRank(F('search_vector'), query))
+            .order_by('-rank', '-id')[:limit]
+        )
+
+
+class InvertedIndex:
+    """
+    In-process inverted index used where Postgres full-text search is not
+    available. Postings map each token to ``{product_id: score}``; a sorted
+    token list gives prefix lookups by bisection.
+    """
+    weights = {'name': 2.0, 'description': 1.0}
+
+    def __init__(self, rows=()):
+        self.postings = defaultdict(dict)
+        # The tokens of each product, to take it out again.
+        self.documents = {}
+        for row in rows:
+            self.add(row)
+        self.tokens = sorted(self.postings)
+
+    def add(self, row):
+        """
+        Index one row and return the tokens it brought into the index.
+        """
+        new = []
+        tokens = self.documents.setdefault(row['id'], set())
+        for field, weight in self.weights.items():
+            for token in tokenize(row[field]):
+                if token not in self.postings:
+                    new.append(token)
+                posting = self.postings[token]
+                posting[row['id']] = posting.get(row['id'], 0.0) + weight
+                tokens.add(token)
+        return new
+
+    def remove(self, product_id):
+        for token in self.documents.pop(product_id, ()):
+            posting = self.postings[token]
+            del posting[product_id]
+            if not posting:
+                del self.postings[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+
+    def replace(self, product_ids, rows):
+        """
+        Re-index the products ``product_ids`` from their current ``rows``;
+        products without a row are dropped.
+        """
+        for product_id in product_ids:
+            self.remove(product_id)
+        for row in rows:
+            for token in self.add(row):
+                insort(self.tokens, token)
+
+    def prefix_scores(self, prefix):
+        scores = defaultdict(float)
+        start = bisect_left(self.tokens, prefix)
+        for token in self.tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            for product_id, score in self.postings[token].items():
+                scores[product_id] += score
+        return scores
+
+    def search(self, text, limit=None):
+        """
+        Return ``(product_id, score)`` pairs matching every term, best first.
+        """
+        ranked = None
+        for term in tokenize(text):
+            scores = self.prefix_scores(term)
+            if ranked is None:
+                ranked = scores
+            else:
+                ranked = {pk: ranked[pk] + scores[pk]
+                          for pk in ranked.keys() & scores.keys()}
+        if not ranked:
+            return []
+        return sorted(ranked.items(),
+                      key=lambda item: (-item[1], -item[0]))[:limit]
+
+
+class InvertedIndexBackend:
+    """
+    Search over an ``InvertedIndex`` of the catalogue, built on the first
+    search and then kept current row by row as products change in this
+    process.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+
+    def refresh(self, queryset):
+        with self._lock:
+            if self._index is None:
+                # Not built yet; the first search reads the current rows.
+                return
+            rows = list(queryset.values('id', 'name', 'description'))
+            self._index.replace([row['id'] for row in rows], rows)
+
+    def forget(self, product_ids):
+        with self._lock:
+            if self._index is not None:
+                self._index.replace(product_ids, ())
+
+    def matches(self, text, limit=None):
+        with self._lock:
+            if self._index is None:
+                self._index = InvertedIndex(
+                    Product.objects.values('id', 'name', 'description')
+                    .iterator(chunk_size=2000)
+                )
+            return self._index.search(text, limit)
+
+    def filter(self, queryset, text):
+        matches = self.matches(text)
+        return queryset.filter(pk__in=[pk for pk, _ in matches])
+
+    def search(self, queryset, text, limit):
+        # The index covers the whole catalogue; over-fetch so rows removed
+        # by the queryset's own filters still leave ``limit`` results.
+        matches = self.matches(text, limit * 4)
+        scores = dict(matches)
+        products = queryset.in_bulk(scores.keys())
+        ranked = sorted(products.values(),
+                        key=lambda product: (-scores[product.pk],
+                                             -product.pk))
+        for product in ranked:
+            product.rank = scores[product.pk]
+        return ranked[:limit]
+
+
+_postgres_backend = PostgresSearchBackend()
+_fallback_backend = InvertedIndexBackend()
+
+
+def get_backend():
+    if connection.vendor == 'postgresql':
+        return _postgres_backend
+    return _fallback_backend
+
+
+def refresh_search_vectors(queryset=None):
+    """
+    Recompute the search data for ``queryset`` (all products by default)
+    with a single set-based update.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    get_backend().refresh(queryset)
+
+
+def forget_products(product_ids):
+    """
+    Drop deleted products from the search data.
+    """
+    get_backend().forget(product_ids)
+
+
+def search_products(text, limit=20, queryset=None):
+    """
+    Return up to ``limit`` active products matching every term of ``text``
+    as a prefix, most relevant first.
+    """
+    if not tokenize(text):
+        return []
+    if queryset is None:
+        queryset = Product.objects.filter(is_active=True)
+    limit = max(1, min(limit, MAX_RESULTS))
+    return get_backend().search(queryset, text, limit)
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    Drop-in replacement for ``SearchFilter`` on products: ``?search=`` is
+    answered from the search index instead of ``ILIKE '%term%'`` scans, and
+    the queryset keeps its own ordering.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '')
+        if not tokenize(text):
+            return queryset
+        return get_backend().filter(queryset, text)
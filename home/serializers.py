@@ -1,4 +1,8 @@
+from django.conf import settings
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .authentication import VERSION_CLAIM, user_version
+from .rows import ValuesSerializer
 from .models import Profile
 from django.contrib.auth.models import User
 from .models import (Category,
@@ -58,6 +62,22 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         return user
 
 
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Login tokens carrying the username, staff flags and user version, which
+    ``home.authentication.ClaimsJWTAuthentication`` reads instead of the
+    user row.
+    """
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        token[VERSION_CLAIM] = user_version(user.pk)
+        return token
+
+
 class ProfileSerializer(serializers.ModelSerializer):
     user = UserRegisterSerializer(read_only=True)
 
@@ -75,25 +95,39 @@ class CategorySerializer(serializers.ModelSerializer):
             'slug': {'read_only': True}
         }
 
+    def validate_parent(self, parent):
+        if (self.instance is not None and parent is not None
+                and self.instance.in_subtree(parent.pk, parent.path)):
+            raise serializers.ValidationError(
+                "A category cannot be moved below itself.")
+        return parent
 
-class ProductSerializer(serializers.ModelSerializer):
+
+class ProductVarientSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Product
+        model = ProductVariant
         fields = '__all__'
         extra_kwargs = {
             'slug': {'read_only': True}
         }
 
 
-class ProductVarientSerializer(serializers.ModelSerializer):
+class ProductSerializer(serializers.ModelSerializer):
     class Meta:
-        model = ProductVariant
-        fields = '__all__'
+        model = Product
+        exclude = ['search_vector']
         extra_kwargs = {
             'slug': {'read_only': True}
         }
 
 
+class ProductDetailSerializer(ProductSerializer):
+    """
+    A product page: the product with its variants, for reads only.
+    """
+    variants = ProductVarientSerializer(many=True, read_only=True)
+
+
 class CartSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cart
@@ -104,13 +138,61 @@ class CartSerializer(serializers.ModelSerializer):
 
 
 class CartItemSerializer(serializers.ModelSerializer):
+    # The product comes along so the line can be priced without a query.
+    product_variant = serializers.PrimaryKeyRelatedField(
+        queryset=ProductVariant.objects.select_related('product'))
+
     class Meta:
         model = CartItem
         fields = '__all__'
         extra_kwargs = {
             'slug': {'read_only': True}
         }
-        read_only_fields = ['cart']
+        # Prices are set by home.pricing, never by the client.
+        read_only_fields = ['cart', 'price_at_time']
+
+
+class CartBulkOperationSerializer(serializers.Serializer):
+    # A plain id: the variants of every operation are loaded in one query
+    # by home.carts rather than one query per operation.
+    product_variant = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0)
+
+
+class CartBulkSerializer(serializers.Serializer):
+    mode = serializers.ChoiceField(choices=['add', 'set'], default='add')
+    items = CartBulkOperationSerializer(
+        many=True, allow_empty=False,
+        max_length=settings.CART_BULK_MAX_ITEMS)
+
+    def validate_items(self, items):
+        variants = [item['product_variant'] for item in items]
+        if len(set(variants)) != len(variants):
+            raise serializers.ValidationError(
+                "Each product variant may only appear once.")
+        return items
+
+
+class CartSummaryLineSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    product = serializers.IntegerField()
+    product_variant = serializers.IntegerField()
+    name = serializers.CharField()
+    variant = serializers.CharField()
+    quantity = serializers.IntegerField()
+    list_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+    unit_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+    line_total = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CartSummarySerializer(serializers.Serializer):
+    cart = serializers.IntegerField()
+    lines = CartSummaryLineSerializer(many=True)
+    item_count = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    coupon = serializers.CharField(allow_null=True)
+    discount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    grand_total = serializers.DecimalField(max_digits=12, decimal_places=2)
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -120,6 +202,8 @@ class OrderSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'slug': {'read_only': True}
         }
+        read_only_fields = ['subtotal', 'discount_total', 'grand_total',
+                            'item_count']
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -177,3 +261,25 @@ class CouponSerializer(serializers.ModelSerializer):
 
 class ApplyCouponSerializer(serializers.Serializer):
     code = serializers.CharField(max_length=10)
+
+
+# Read paths of the hot catalogue endpoints: the same output as the model
+# serializers, rendered from .values() rows (see home.rows).
+class CategoryReadSerializer(ValuesSerializer):
+    model_serializer = CategorySerializer
+
+
+class ProductVarientReadSerializer(ValuesSerializer):
+    model_serializer = ProductVarientSerializer
+
+
+class ProductReadSerializer(ValuesSerializer):
+    model_serializer = ProductSerializer
+
+
+class ProductDetailReadSerializer(ValuesSerializer):
+    model_serializer = ProductDetailSerializer
+
+
+class ReviewReadSerializer(ValuesSerializer):
+    model_serializer = ReviewSerializer
@@ -1,7 +1,19 @@
-from django.db.models.signals import post_save
+from functools import partial
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import (post_save, pre_save, post_delete,
+                                      m2m_changed)
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from .models import (Profile, Category, Product, ProductVariant, Review,
+                     OrderItem)
+from . import cache
+from .authentication import bump_user
+from .categories import invalidate_tree
+from .orders import recalculate_totals
+from .ratings import move_rating
+from .search import forget_products, refresh_search_vectors
 
 
 @receiver(post_save, sender=User)
@@ -9,3 +21,120 @@ def create_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
     instance.profile.save()
+
+
+def _on_commit(bump, *args):
+    # Cache versions move once the change is committed: bumped any earlier,
+    # a read in between would cache the old rows under the new version.
+    transaction.on_commit(partial(bump, *args))
+
+
+def _deletes_products(origin):
+    """
+    Whether a deletion started from ``origin`` (an instance or a queryset)
+    takes products with it, so that their reviews and variants need no
+    bookkeeping of their own.
+    """
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (Category, Product)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Password, activity and permission changes must reach requests
+    # authenticated from the cache (home.authentication).
+    _on_commit(bump_user, instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree(sender, instance, **kwargs):
+    # Moving a category changes what ?category_tree= listings contain.
+    _on_commit(invalidate_tree)
+    _on_commit(cache.bump_versions, cache.ALL)
+
+
+def _product_category_id(instance):
+    """
+    Category of the product a variant or review belongs to, without a query
+    when the product is already loaded on the instance.
+    """
+    if instance._meta.get_field('product').is_cached(instance):
+        return instance.product.category_id
+    return Product.objects.filter(pk=instance.product_id).values_list(
+        'category_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    # A product moved to another category must also invalidate the listings
+    # of the category it left (see Product.save).
+    _on_commit(cache.bump_category, instance.category_id,
+               getattr(instance, '_previous_category_id', None))
+
+
+@receiver(post_save, sender=Product)
+def update_product_search(sender, instance, **kwargs):
+    # Only name and description changes reach the search data; raw saves
+    # (fixtures) do not go through Product.save and are always refreshed.
+    if getattr(instance, '_search_changed', True):
+        refresh_search_vectors(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+def forget_product_search(sender, instance, **kwargs):
+    forget_products([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_product_tags(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if isinstance(instance, Product):
+            _on_commit(cache.bump_category, instance.category_id)
+        else:
+            _on_commit(cache.bump_versions, cache.ALL)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_product_children(sender, instance, origin=None, **kwargs):
+    if origin is not None and _deletes_products(origin):
+        return
+    _on_commit(cache.bump_category, _product_category_id(instance))
+
+
+def _review_changed(instance):
+    _on_commit(cache.bump_category, _product_category_id(instance))
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    # An edited review moves its old rating out of the aggregates.
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = Review.objects.filter(
+            pk=instance.pk).values_list('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def add_product_rating(sender, instance, **kwargs):
+    move_rating(getattr(instance, '_previous_rating', None),
+                (instance.product_id, instance.rating))
+    _review_changed(instance)
+
+
+@receiver(post_delete, sender=Review)
+def remove_product_rating(sender, instance, origin, **kwargs):
+    # Deleted with its product: there are no aggregates left to move.
+    if _deletes_products(origin):
+        return
+    move_rating(previous=(instance.product_id, instance.rating))
+    _review_changed(instance)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals(sender, instance, **kwargs):
+    recalculate_totals([instance.order_id])
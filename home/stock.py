@@ -0,0 +1,119 @@
+import datetime
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from . import cache
+from .models import CartItem, ProductVariant
+
+
+class NotEnoughStock(Exception):
+    """
+    Some product variants cannot cover the requested quantities;
+    ``args[0]`` lists them.
+    """
+
+
+def _bump_stock_categories(variant_ids):
+    cache.bump_category(*set(
+        ProductVariant.objects.filter(pk__in=variant_ids)
+        .values_list('product__category_id', flat=True)))
+
+
+def stock_changed(variant_ids):
+    """
+    Drop the cached catalogue pages showing the stock of these variants.
+
+    Stock moves with ``QuerySet.update()``, which fires no signals. The
+    versions are bumped once the transaction commits, so a read in between
+    cannot cache the old stock under the new version.
+    """
+    variant_ids = list(variant_ids)
+    if variant_ids:
+        transaction.on_commit(partial(_bump_stock_categories, variant_ids))
+
+
+def adjust_stock(deltas):
+    """
+    Take ``deltas[variant_id]`` units of each variant's stock (a negative
+    delta returns units) with one conditional ``UPDATE``.
+
+    Returns ``False`` when any variant would be oversold. Variants that had
+    enough stock were still updated, so the caller must roll back.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return True
+    enough = Q()
+    for pk, delta in deltas.items():
+        enough |= Q(pk=pk, stock_count__gte=delta)
+    updated = ProductVariant.objects.filter(enough).update(
+        stock_count=F('stock_count') - Case(
+            *[When(pk=pk, then=Value(delta))
+              for pk, delta in deltas.items()],
+            output_field=IntegerField()),
+        updated_at=timezone.now())
+    stock_changed(deltas)
+    return updated == len(deltas)
+
+
+def return_stock(quantities):
+    """
+    Give ``quantities[variant_id]`` units back to each variant, with one
+    ``UPDATE`` per distinct quantity.
+    """
+    by_quantity = defaultdict(list)
+    for pk, quantity in quantities.items():
+        if quantity:
+            by_quantity[quantity].append(pk)
+    for quantity, pks in by_quantity.items():
+        ProductVariant.objects.filter(pk__in=pks).update(
+            stock_count=F('stock_count') + quantity,
+            updated_at=timezone.now())
+    stock_changed(quantities)
+
+
+def hold_expiry():
+    """
+    When a cart line changed now stops holding its stock.
+    """
+    return timezone.now() + datetime.timedelta(
+        seconds=settings.CART_HOLD_TIMEOUT)
+
+
+def release_expired_holds(batch_size, now=None):
+    """
+    Return the stock held by cart lines whose hold expired before ``now``
+    and mark the lines released, ``batch_size`` lines per transaction.
+
+    Each batch is three set-based statements: a locking read of the
+    oldest expired lines through the partial ``reserved_until`` index,
+    one ``UPDATE`` of those lines and ``return_stock``. Lines locked by a
+    checkout or a cart change are skipped rather than waited for. Returns
+    the number of lines released.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            lines = list(
+                CartItem.objects.select_for_update(skip_locked=True)
+                .filter(reserved_until__lt=now)
+                .order_by('reserved_until')
+                .values_list('pk', 'product_variant_id', 'quantity')
+                [:batch_size])
+            if not lines:
+                return released
+            CartItem.objects.filter(
+                pk__in=[pk for pk, _, _ in lines]).update(reserved_until=None)
+            quantities = defaultdict(int)
+            for _, variant_id, quantity in lines:
+                quantities[variant_id] += quantity
+            return_stock(quantities)
+        released += len(lines)
+        if len(lines) < batch_size:
+            return released
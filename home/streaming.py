@@ -0,0 +1,72 @@
+"""
+Streamed NDJSON list responses for staff exports.
+
+``?stream=1``, ``?format=ndjson`` or an ``Accept: application/x-ndjson``
+header turns a list into one JSON object per line, written while the rows
+are read from a server-side cursor. Memory stays at one chunk of rows
+however many rows the list has, and pagination does not apply.
+"""
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Lets clients ask for NDJSON. Streamed lists bypass it; anything else,
+    such as an error, is rendered as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return (JSONEncoder(ensure_ascii=False).encode(data)
+                + '\n').encode(self.charset)
+
+
+def wants_stream(request):
+    return (request.query_params.get('stream') == '1'
+            or request.accepted_renderer.format == NDJSONRenderer.format)
+
+
+def ndjson_lines(serializer, queryset, chunk_size):
+    """
+    Yield ``queryset`` serialized one row per line, a chunk of rows at a
+    time.
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    chunk = []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(encoder.encode(serializer.to_representation(instance)))
+        if len(chunk) == chunk_size:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+class StreamingListMixin:
+    """
+    Viewset mixin whose ``stream_list`` answers a list request with NDJSON
+    when the client asks for it (see ``wants_stream``), and ``None``
+    otherwise.
+    """
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES,
+                        NDJSONRenderer]
+
+    def stream_list(self, queryset):
+        if not wants_stream(self.request):
+            return None
+        if not self.request.user.is_staff:
+            raise PermissionDenied("Streamed lists are for staff only.")
+        return StreamingHttpResponse(
+            ndjson_lines(self.get_serializer(), queryset,
+                         settings.STREAM_CHUNK_SIZE),
+            content_type=NDJSONRenderer.media_type,
+        )
@@ -1,5 +1,19 @@
-from celery import shared_task
-from .models import ProductVariant
+import logging
+
+from celery import chord, group, shared_task
+from django.conf import settings
+from django.core.cache import caches
+from django.core.mail import send_mail
+from django.db import DatabaseError, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from . import cache
+from .models import (Category, Order, Payment, PaymentMethod, PaymentStatus,
+                     ProductVariant)
+from .stock import release_expired_holds
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
@@ -10,13 +24,203 @@ def add(x, y):
     return x + y
 
 
+def refill_policies():
+    """
+    Resolve ``settings.STOCK_REFILL_POLICIES`` (keyed by category slug) to
+    ``[[category_id, threshold, refill_to], ...]``.
+    """
+    overrides = getattr(settings, 'STOCK_REFILL_POLICIES', {})
+    return [
+        [pk, overrides[slug]['threshold'], overrides[slug]['refill_to']]
+        for slug, pk in Category.objects.filter(slug__in=overrides)
+        .values_list('slug', 'pk')
+    ]
+
+
+def refill_range(start, end, threshold, refill_to, policies=()):
+    """
+    Refill the variants with ``start <= id < end`` using one ``UPDATE`` per
+    category policy plus one for the default policy, and return the number
+    of rows changed.
+    """
+    chunk = ProductVariant.objects.filter(pk__gte=start, pk__lt=end)
+    refilled = 0
+    for category_id, policy_threshold, policy_refill_to in policies:
+        refilled += chunk.filter(
+            product__category_id=category_id,
+            stock_count__lt=policy_threshold,
+        ).update(stock_count=policy_refill_to, updated_at=timezone.now())
+    default = chunk.filter(stock_count__lt=threshold)
+    if policies:
+        default = default.exclude(
+            product__category_id__in=[policy[0] for policy in policies])
+    return refilled + default.update(stock_count=refill_to,
+                                     updated_at=timezone.now())
+
+
+def chunk_bounds(chunk_size):
+    bounds = ProductVariant.objects.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return []
+    return [
+        (start, start + chunk_size)
+        for start in range(bounds['low'], bounds['high'] + 1, chunk_size)
+    ]
+
+
 @shared_task
-def refill_stock(threshold=10, refill_to=100):
+def refill_stock_chunk(start, end, threshold=10, refill_to=100,
+                       policies=()):
+    return refill_range(start, end, threshold, refill_to, policies)
+
+
+@shared_task
+def summarize_refill(counts):
+    refilled = sum(counts)
+    if refilled:
+        cache.bump_catalogue()
+    return f"Refilled stock for {refilled} products."
+
+
+@shared_task(bind=True)
+def refill_stock(self, threshold=10, refill_to=100, chunk_size=10000,
+                 fan_out=False):
     """
     Refill stock for products with stock below the threshold.
+
+    Variants are processed in primary-key ranges of ``chunk_size`` with a
+    set-based ``UPDATE`` per range, so no rows are loaded into Python and
+    every range commits on its own. Categories listed in
+    ``settings.STOCK_REFILL_POLICIES`` use their own threshold/refill level.
+    With ``fan_out`` the ranges are spread across workers as a chord.
+    """
+    bounds = chunk_bounds(chunk_size)
+    policies = refill_policies()
+    if fan_out and bounds:
+        return self.replace(chord(
+            (refill_stock_chunk.s(start, end, threshold, refill_to, policies)
+             for start, end in bounds),
+            summarize_refill.s(),
+        ))
+    return summarize_refill(
+        [refill_range(start, end, threshold, refill_to, policies)
+         for start, end in bounds])
+
+
+@shared_task
+def release_expired_cart_holds(batch_size=None):
+    """
+    Give back the stock of cart lines whose hold expired; scheduled by
+    ``CELERY_BEAT_SCHEDULE``.
+    """
+    released = release_expired_holds(
+        batch_size or settings.CART_HOLD_SWEEP_BATCH)
+    return f"Released {released} expired cart holds."
+
+
+# Order post-processing: every step may run more than once (task retries,
+# redelivered messages) and must leave the same result as running it once.
+RETRY_OPTIONS = {
+    'autoretry_for': (DatabaseError,),
+    'retry_backoff': True,
+    'max_retries': 5,
+}
+
+
+def pending_payment(order_id, payment_method=None):
+    """
+    Return ``(payment, created)`` for the pending payment of an order,
+    creating it (cash on delivery unless ``payment_method`` says otherwise)
+    when there is none, or ``(None, False)`` for a missing order. A given
+    ``payment_method`` replaces the one of an existing payment.
+
+    The order pipeline and the payments API both go through here under the
+    order's row lock, so an order never gets two pending payments.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(
+            pk=order_id).only('grand_total').first()
+        if order is None:
+            return None, False
+        payment = order.payments.filter(
+            payment_status=PaymentStatus.Pending).first()
+        if payment is None:
+            payment = Payment.objects.create(
+                order=order, amount=order.grand_total,
+                payment_status=PaymentStatus.Pending,
+                payment_method=payment_method or PaymentMethod.COD)
+            return payment, True
+        if payment_method and payment.payment_method != payment_method:
+            payment.payment_method = payment_method
+            payment.save(update_fields=['payment_method'])
+    return payment, False
+
+
+@shared_task(**RETRY_OPTIONS)
+def record_order_payment(order_id):
+    """
+    Create the pending cash-on-delivery payment of an order, unless it has
+    one already. Returns the new payment's id.
+    """
+    payment, created = pending_payment(order_id)
+    return payment.pk if created else None
+
+
+@shared_task(**RETRY_OPTIONS)
+def check_order_stock(order_id):
+    """
+    Report the ordered variants left with ``LOW_STOCK_THRESHOLD`` units or
+    fewer, each at most once per ``LOW_STOCK_ALERT_INTERVAL``. Units are
+    taken from stock when they are put in the cart (``home.stock``), so
+    once the order is placed these levels are final. Returns the reported
+    variant ids.
+    """
+    low = ProductVariant.objects.filter(
+        orderitem__order_id=order_id,
+        stock_count__lte=settings.LOW_STOCK_THRESHOLD,
+    ).values_list('pk', 'stock_count')
+    reported = []
+    for pk, stock_count in low:
+        if caches['default'].add(f'low-stock:{pk}', stock_count,
+                                 timeout=settings.LOW_STOCK_ALERT_INTERVAL):
+            logger.warning("Variant %s is low on stock: %s left.",
+                           pk, stock_count)
+            reported.append(pk)
+    return reported
+
+
+@shared_task(autoretry_for=(DatabaseError, OSError), retry_backoff=True,
+             max_retries=5)
+def send_order_confirmation(order_id):
+    """
+    Email the customer that the order was placed, once. Returns whether
+    this run sent it.
+    """
+    with transaction.atomic():
+        # Claiming the order and sending commit together: a failed send
+        # rolls the claim back for the retry, and a concurrent run waits on
+        # the row and then finds it claimed.
+        claimed = Order.objects.filter(
+            pk=order_id, confirmation_sent_at__isnull=True,
+        ).update(confirmation_sent_at=timezone.now())
+        if not claimed:
+            return False
+        order = Order.objects.select_related('user').get(pk=order_id)
+        if order.user.email:
+            send_mail(
+                f"Order #{order.pk} confirmed",
+                f"Thank you for your order of {order.item_count} item(s), "
+                f"{order.grand_total} in total.",
+                None, [order.user.email])
+    return True
+
+
+ORDER_PIPELINE = (record_order_payment, check_order_stock,
+                  send_order_confirmation)
+
+
+def process_order(order_id):
+    """
+    Queue the post-processing of a placed order, one task per step.
     """
-    products = ProductVariant.objects.filter(stock_count__lt=threshold)
-    for product in products:
-        product.stock_count = refill_to
-        product.save()
-    return f"Refilled stock for {products.count()} products."
+    return group(task.si(order_id) for task in ORDER_PIPELINE).apply_async()
@@ -0,0 +1,157 @@
+"""
+Token-bucket rate limiting for the API.
+
+Every client gets one bucket per route (the URL name from ``home.urls``):
+authenticated users by id, anonymous clients by IP (``X-Forwarded-For`` is
+trusted only as far as ``NUM_PROXIES`` allows). A bucket holds up to
+``capacity`` tokens and refills continuously at ``capacity / period``, so
+``'60/min'`` allows a burst of 60 requests and then one a second; each
+request takes a token or is answered 429 with a ``Retry-After`` of the time
+until the next one. Rates come from ``THROTTLE_RATES`` by route name, with
+``'default'`` covering the routes not listed; a route without rates is not
+throttled.
+
+Buckets live in Redis (``THROTTLE_REDIS_URL``), where a Lua script refills
+and takes a token atomically in one round trip, with Redis's clock, so every
+web worker shares them. Without a Redis URL the buckets are kept in-process,
+which is what the tests use. Checks cost the same whatever the traffic: a
+bucket is two numbers, not a log of requests.
+"""
+import logging
+import threading
+import time
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'throttle'
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+# KEYS[1]: the bucket; ARGV: capacity, tokens per second.
+# Returns {1 if a token was taken else 0, seconds until the next token}.
+TAKE_TOKEN = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or capacity
+local at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+local taken = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    taken = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {taken, tostring(math.max(0, 1 - tokens) / rate)}
+"""
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """
+    ``'<capacity>/<period>'`` as ``(capacity, tokens per second)``; the
+    period is anything starting with s, m, h or d.
+    """
+    capacity, period = rate.split('/')
+    capacity = int(capacity)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalBuckets:
+    """
+    In-process token buckets, for tests and single-process setups.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """
+        Take a token from the bucket ``key``. Returns whether there was one
+        and the seconds until the next token.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, at = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - at) * rate)
+            taken = tokens >= 1
+            if taken:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+        return taken, max(0, 1 - tokens) / rate
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class RedisBuckets:
+    """
+    Token buckets shared through Redis, one script call per check.
+    """
+
+    def __init__(self, url):
+        # Every API request waits on the check: an unresponsive Redis has to
+        # fail open quickly rather than hold the worker.
+        self.client = redis.Redis.from_url(url, socket_connect_timeout=0.2,
+                                           socket_timeout=0.2)
+        self.script = self.client.register_script(TAKE_TOKEN)
+
+    def take(self, key, capacity, rate):
+        taken, wait = self.script(keys=[key], args=[capacity, rate])
+        return bool(taken), float(wait)
+
+
+@lru_cache(maxsize=None)
+def _buckets(url):
+    return RedisBuckets(url) if url else LocalBuckets()
+
+
+def get_buckets():
+    return _buckets(settings.THROTTLE_REDIS_URL)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Per-route, per-client token buckets configured by ``THROTTLE_RATES``.
+    A view's ``throttle_route`` overrides the route name of its URL.
+
+    Fails open: a request is let through when Redis cannot be reached or
+    does not answer within 200ms.
+    """
+
+    def allow_request(self, request, view):
+        match = request.resolver_match
+        route = getattr(view, 'throttle_route', None) or (
+            match.url_name if match is not None else None)
+        rates = settings.THROTTLE_RATES
+        rates = rates.get(route, rates.get('default', {}))
+        if request.user and request.user.is_authenticated:
+            scope, ident = 'user', request.user.pk
+        else:
+            scope, ident = 'anon', self.get_ident(request)
+        rate = rates.get(scope)
+        if rate is None:
+            return True
+
+        capacity, per_second = parse_rate(rate)
+        key = f'{KEY_PREFIX}:{route}:{scope}:{ident}'
+        try:
+            allowed, self.retry_after = get_buckets().take(
+                key, capacity, per_second)
+        except redis.RedisError:
+            logger.warning("Rate limiting is off: Redis is unavailable.",
+                           exc_info=True)
+            return True
+        return allowed
+
+    def wait(self):
+        return self.retry_after
@@ -10,7 +10,11 @@ from .views import (
     ShippingAddressViewSet,
     WishlistViewSet,
     CouponViewSet,
+    QueryMetricsView,
+    ProductImportView,
+    ProductExportView,
 )
+from . import async_views
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -37,6 +41,25 @@ urlpatterns = [
          name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(),
          name='token_refresh'),
+    path('api/metrics/queries/', QueryMetricsView.as_view(),
+         name='query-metrics'),
+    path('api/catalogue/import/', ProductImportView.as_view(),
+         name='catalogue-import'),
+    path('api/catalogue/export/', ProductExportView.as_view(),
+         name='catalogue-export'),
+
+    path('api/async/products/', async_views.product_list,
+         name='async-products-list'),
+    path('api/async/products/<int:pk>/', async_views.product_detail,
+         name='async-products-detail'),
+    path('api/async/products/<int:pk>/reviews/',
+         async_views.product_reviews, name='async-products-list-reviews'),
+    path('api/async/category/', async_views.category_list,
+         name='async-category-list'),
+    path('api/async/product-variants/', async_views.variant_list,
+         name='async-product-variants-list'),
+    path('api/async/product-variants/<int:pk>/', async_views.variant_detail,
+         name='async-product-variants-detail'),
 
     path('api/', include(router.urls)),
 ]
@@ -1,39 +1,67 @@
+import codecs
+
 from rest_framework import viewsets, filters
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from .serializers import UserRegisterSerializer
 from .serializers import (ProfileSerializer,
                           CategorySerializer,
+                          CategoryReadSerializer,
                           ProductSerializer,
+                          ProductReadSerializer,
+                          ProductDetailReadSerializer,
                           ProductVarientSerializer,
+                          ProductVarientReadSerializer,
                           CartSerializer,
                           CartItemSerializer,
+                          CartBulkSerializer,
+                          CartSummarySerializer,
                           OrderSerializer,
                           OrderItemSerializer,
                           PaymentSerializer,
                           ShippingAddressSerializer,
                           ReviewSerializer,
+                          ReviewReadSerializer,
                           WishlistSerializer,
                           CouponSerializer,
                           ApplyCouponSerializer
                           )
 from rest_framework import status
 from .permissions import IsSuperUserOrReadOnly
+from .pagination import KeysetPagination
+from .cache import catalogue_cached
+from .conditional import conditional
+from .orders import place_order, EmptyCart, CartChanged
+from .pricing import cached_cart_summary, cart_summary
+from .carts import apply_operations, NotEnoughStock, UnknownVariants
+from .search import search_products, ProductSearchFilter
+from .categories import CategoryTreeFilter
+from .middleware import query_metrics
+from .loading import EagerLoadingMixin, eager_load
+from .streaming import StreamingListMixin
+from .authentication import ClaimsJWTAuthentication
+from .tasks import pending_payment
 from rest_framework.views import APIView
-from django.db.models import Sum, F
+from rest_framework.parsers import MultiPartParser
+from . import product_io
 from .models import (Profile,
                      Category,
+                     CategoryCycle,
                      Product,
                      ProductVariant,
                      Order,
                      OrderItem,
                      Cart,
                      Payment,
+                     PaymentMethod,
+                     PaymentStatus,
                      ShippingAddress,
                      Review,
                      Wishlist,
@@ -58,13 +86,69 @@ class UserRegister(APIView):
         )
 
 
-class ProfileViewSet(viewsets.ModelViewSet):
+class QueryMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(query_metrics.snapshot())
+
+
+class ProductImportView(APIView):
+    """
+    Import an uploaded CSV or NDJSON ``file`` of products; see
+    ``home.product_io`` for the layout.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response(
+                {"detail": "Upload the products as 'file'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            format = product_io.file_format(
+                upload.name, request.data.get('file_format'))
+            # Large uploads are spooled to disk and read line by line.
+            result = product_io.import_products(
+                codecs.iterdecode(upload, 'utf-8-sig'), format)
+        except ValueError as exc:
+            return Response({"detail": str(exc)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
+
+
+class ProductExportView(APIView):
+    """
+    Stream the catalogue as CSV, or NDJSON with ``?file_format=ndjson``.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            format = product_io.file_format(
+                '', request.query_params.get('file_format', 'csv'))
+        except ValueError as exc:
+            return Response({"detail": str(exc)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return StreamingHttpResponse(
+            product_io.export_products(format),
+            content_type=product_io.CONTENT_TYPES[format],
+            headers={'Content-Disposition':
+                     f'attachment; filename="products.{format}"'},
+        )
+
+
+class ProfileViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     serializer_class = ProfileSerializer
     permission_classes = [IsSuperUserOrReadOnly]
+    authentication_classes = [ClaimsJWTAuthentication]
 
     def get_queryset(self):
         user = self.request.user
-        return Profile.objects.filter(user=user)
+        return self.eager_load(Profile.objects.filter(user_id=user.pk))
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
@@ -86,28 +170,52 @@ class ProfileViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(StreamingListMixin, EagerLoadingMixin,
+                      viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    read_serializer_classes = {'list': CategoryReadSerializer,
+                               'retrieve': CategoryReadSerializer}
     permission_classes = [IsSuperUserOrReadOnly]
 
+    @conditional
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
+        streamed = self.stream_list(queryset.order_by('pk'))
+        if streamed is not None:
+            return streamed
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @conditional
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        # validate_parent checks the paths it was given; the save checks
+        # them again under its transaction.
+        try:
+            serializer.save()
+        except CategoryCycle as exc:
+            raise ValidationError({'parent': [str(exc)]})
 
-class ProductViewSet(viewsets.ModelViewSet):
+
+class ProductViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all().order_by('-created_at')
     serializer_class = ProductSerializer
+    read_serializer_classes = {'list': ProductReadSerializer,
+                               'retrieve': ProductDetailReadSerializer}
     permission_classes = [IsSuperUserOrReadOnly]
+    pagination_class = KeysetPagination
 
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter,
-                       filters.OrderingFilter]
-    filterset_fields = ['category', 'name']
-    search_fields = ['name', 'description']
-    ordering_fields = ['created_at', 'price']
+    filter_backends = [DjangoFilterBackend, CategoryTreeFilter,
+                       ProductSearchFilter, filters.OrderingFilter]
+    filterset_fields = ['category', 'name', 'is_active']
+    ordering_fields = ['created_at', 'price', 'rating_average',
+                       'rating_count']
 
+    @conditional
+    @catalogue_cached
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
         page = self.paginate_queryset(queryset)
@@ -117,6 +225,11 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @conditional
+    @catalogue_cached
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -183,19 +296,47 @@ class ProductViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED
         )
 
+    @action(detail=False, methods=['get'], url_path='search')
+    @catalogue_cached
+    def search(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response(
+                {"detail": "limit must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        products = search_products(
+            query, limit=limit,
+            queryset=self.get_queryset().filter(is_active=True))
+        serializer = self.get_serializer(products, many=True)
+        return Response(serializer.data)
+
     @action(detail=True, methods=['get'], url_path='reviews')
+    @catalogue_cached
     def list_reviews(self, request, pk=None):
         product = get_object_or_404(Product, pk=pk)
-        reviews = product.reviews.all()
-        serializer = ReviewSerializer(reviews, many=True)
+        reviews = eager_load(product.reviews.all(), ReviewReadSerializer)
+        serializer = ReviewReadSerializer(reviews, many=True)
         return Response(serializer.data)
 
 
-class ProductVarientViewSet(viewsets.ModelViewSet):
+class ProductVarientViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = ProductVariant.objects.all()
     serializer_class = ProductVarientSerializer
+    read_serializer_classes = {'list': ProductVarientReadSerializer,
+                               'retrieve': ProductVarientReadSerializer}
     permission_classes = [IsSuperUserOrReadOnly]
 
+    @conditional
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=True, methods=['get'], url_path='variants')
     def list_varient(self, request, *args, **kwargs):
         product = self.get_object()
@@ -225,46 +366,93 @@ class ProductVarientViewSet(viewsets.ModelViewSet):
             )
 
 
-class CartViewSet(viewsets.ModelViewSet):
+class CartViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
-    http_method_names = ['get', 'post']
+    http_method_names = ['get', 'post', 'put']
 
     def get_queryset(self):
         user = self.request.user
-        return Cart.objects.filter(user=user)
+        return self.eager_load(Cart.objects.filter(user=user))
 
     def retrieve(self, request, *args, **kwargs):
         cart, _ = Cart.objects.get_or_create(user=request.user)
         serializer = self.get_serializer(cart)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path='summary')
+    def summary(self, request):
+        cart, _ = Cart.objects.get_or_create(user=request.user)
+        data = cached_cart_summary(
+            cart, lambda summary: CartSummarySerializer(summary).data)
+        return Response(data)
+
     @action(detail=False, methods=['post'], url_path='add')
     def add_item(self, request):
         cart, _ = Cart.objects.get_or_create(user=request.user)
         serializer = CartItemSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         product_variant = serializer.validated_data['product_variant']
-        quantity = serializer.validated_data['quantity']
-        # price_at_time = serializer.validated_data['price_at_time']
-        if product_variant.stock_count < quantity:
+        lines = self.change_lines(
+            cart, {product_variant.pk: serializer.validated_data['quantity']})
+        if isinstance(lines, Response):
+            return lines
+        serializer = CartItemSerializer(lines[product_variant.pk])
+        return Response(serializer.data)
+
+    def change_lines(self, cart, quantities, replace=False):
+        """
+        ``apply_operations`` for the single-line actions: the lines left
+        in the cart, or the error response.
+        """
+        try:
+            return apply_operations(cart, quantities, replace=replace)
+        except NotEnoughStock:
             return Response(
                 {"detail": "Not enough stock."},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        cart_item, created = cart.items.get_or_create(
-            product_variant=product_variant,
-            defaults={'quantity': quantity
-                      }
-        )
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
-        product_variant.stock_count -= quantity
+        except CartChanged:
+            return Response(
+                {"detail": "Cart item was modified, please retry."},
+                status=status.HTTP_409_CONFLICT
+            )
 
-        product_variant.save()
-        serializer = CartItemSerializer(cart_item)
-        return Response(serializer.data)
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Apply a list of ``{product_variant, quantity}`` operations at once.
+        In ``add`` mode (the default) quantities are added to the lines, in
+        ``set`` mode they replace them and 0 removes a line. Responds with
+        the cart summary.
+        """
+        serializer = CartBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart, _ = Cart.objects.get_or_create(user=request.user)
+        quantities = {item['product_variant']: item['quantity']
+                      for item in serializer.validated_data['items']}
+        try:
+            apply_operations(
+                cart, quantities,
+                replace=serializer.validated_data['mode'] == 'set')
+        except UnknownVariants as exc:
+            return Response(
+                {"detail": "Unknown product variants.",
+                 "product_variants": exc.args[0]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except NotEnoughStock as exc:
+            return Response(
+                {"detail": "Not enough stock.",
+                 "product_variants": exc.args[0]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except CartChanged:
+            return Response(
+                {"detail": "Cart was modified, please retry."},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(CartSummarySerializer(cart_summary(cart)).data)
 
     @action(detail=False, methods=['put'], url_path='update')
     def update_item(self, request):
@@ -273,43 +461,35 @@ class CartViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         product_variant = serializer.validated_data['product_variant']
         quantity = serializer.validated_data['quantity']
-        price_at_time = serializer.validated_data['price_at_time']
-        cart_item = cart.items.filter(product_variant=product_variant).first()
-        if not cart_item:
+        if not cart.items.filter(product_variant=product_variant).exists():
             return Response(
                 {"detail": "Item not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
+        lines = self.change_lines(cart, {product_variant.pk: quantity},
+                                  replace=True)
+        if isinstance(lines, Response):
+            return lines
         if quantity == 0:
-            cart_item.delete()
-            return Response({"detail": "Item removed from cart."}, status=204)
-
-        total_available = product_variant.stock_count + cart_item.quantity
-        if quantity > total_available:
-            return Response(
-                {"detail": "Not enough stock available."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        product_variant.stock_count = total_available - quantity
-        product_variant.save()
-
-    # Update cart item
-        cart_item.quantity = quantity
-        cart_item.price_at_time = price_at_time
-        cart_item.save()
+            return Response({"detail": "Item removed from cart."},
+                            status=204)
 
-    # Return updated cart item data
-        serializer = CartItemSerializer(cart_item)
+        serializer = CartItemSerializer(lines[product_variant.pk])
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+class OrderViewSet(StreamingListMixin, EagerLoadingMixin,
+                   viewsets.ModelViewSet):
+    queryset = Order.objects.all().order_by('-created_at')
     serializer_class = OrderSerializer
     permission_classes = [IsSuperUserOrReadOnly]
+    pagination_class = KeysetPagination
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
+        streamed = self.stream_list(queryset)
+        if streamed is not None:
+            return streamed
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -319,23 +499,24 @@ class OrderViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['post'], url_path='create')
     def create_order(self, request, *args, **kwargs):
-        user = self.request.user
-        cart = Cart.objects.prefetch_related('items').filter(
-                                                    user=user).first()
-        if not cart or cart.items.count() == 0:
+        try:
+            order = place_order(self.request.user)
+        except EmptyCart:
             return Response(
                 {"detail": "Cart is empty."},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        order = Order.objects.create(user=user)
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product_variant=item.product_variant,
-                quantity=item.quantity,
-                price_at_time=item.price_at_time
+        except CartChanged:
+            return Response(
+                {"detail": "Cart changed during checkout, please retry."},
+                status=status.HTTP_409_CONFLICT
+            )
+        except NotEnoughStock as exc:
+            return Response(
+                {"detail": "Not enough stock.",
+                 "product_variants": exc.args[0]},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        cart.items.all().delete()
         serializer = self.get_serializer(order)
         return Response(serializer.data)
 
@@ -369,12 +550,13 @@ class OrderViewSet(viewsets.ModelViewSet):
                 {"detail": "Order not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
-        items = OrderItem.objects.filter(order=order)
+        items = eager_load(OrderItem.objects.filter(order=order),
+                           OrderItemSerializer)
         serializer = OrderItemSerializer(items, many=True)
         return Response(serializer.data)
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsSuperUserOrReadOnly]
@@ -388,63 +570,28 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 {"detail": "Order not found or access denied."},
                 status=status.HTTP_404_NOT_FOUND
             )
-        amount = order.items.aggregate(
-                total=Sum(F('price_at_time') * F('quantity'))
-                                        )['total']
-        payment_method = request.data.get('payment_method')
-        if order.payment_status == 'paid':
+        if order.payment_status == PaymentStatus.Paid:
             return Response(
                 {"detail": "Order already paid."},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        if order.payment_status == 'unpaid':
-            payment = Payment.objects.create(
-                order=order,
-                amount=amount,
-                payment_status='unpaid',
-                payment_method=payment_method
-            )
-            order.payment_status = 'unpaid'
-            order.save()
-            serializer = self.get_serializer(payment)
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED
-            )
-        if order.payment_status == 'failed':
-            payment = Payment.objects.create(
-                order=order,
-                amount=amount,
-                payment_status='failed',
-                payment_method=payment_method
-            )
-            order.payment_status = 'failed'
-            order.save()
+        payment_method = request.data.get('payment_method')
+        if payment_method and payment_method not in PaymentMethod.values:
             return Response(
-                {"detail": "Payment failed."},
+                {"payment_method": ["Not a valid payment method."]},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        if order.payment_status == 'pending':
-            payment = Payment.objects.create(
-                order=order,
-                amount=amount,
-                payment_status='pending',
-                payment_method=payment_method
-            )
-            order.payment_status = 'pending'
-            order.save()
-            serializer = self.get_serializer(payment)
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED
-            )
+        # Placing the order already queued its pending payment
+        # (record_order_payment); whichever comes first creates it.
+        payment, created = pending_payment(order.pk, payment_method)
+        serializer = self.get_serializer(payment)
         return Response(
-            {"detail": "You do not have permission to create a payment."},
-            status=status.HTTP_403_FORBIDDEN
+            serializer.data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
         )
 
 
-class ShippingAddressViewSet(viewsets.ModelViewSet):
+class ShippingAddressViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = ShippingAddress.objects.all()
     serializer_class = ShippingAddressSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
@@ -534,12 +681,14 @@ class ShippingAddressViewSet(viewsets.ModelViewSet):
         )
 
 
-class WishlistViewSet(viewsets.ModelViewSet):
+class WishlistViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     serializer_class = WishlistSerializer
     permission_classes = [IsAuthenticated]
+    authentication_classes = [ClaimsJWTAuthentication]
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        return self.eager_load(
+            Wishlist.objects.filter(user_id=self.request.user.pk))
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
@@ -574,7 +723,7 @@ class WishlistViewSet(viewsets.ModelViewSet):
         )
 
 
-class CouponViewSet(viewsets.ModelViewSet):
+class CouponViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Coupon.objects.all()
     serializer_class = CouponSerializer
     permission_classes = [IsAuthenticated]